@@ -0,0 +1,181 @@
+"""Benchmark of the code paths the front-ends depend on, on synthetic timesheets.
+
+Times the Summary window's entries (tinker.get_descriptions_with_durations), the
+startup choices (tinker.get_unique_data), the curses description list and timesheet
+(timer.last_descriptions_from_csv, timer.display_timesheet) and a save through the
+sync worker (journal, download, append, upload against a local "remote" directory).
+Everything runs headless: the Tk methods are called on an app object that never
+creates a window, and curses gets a stand-in screen. Each path is timed cold (no
+in-memory or on-disk caches) and warm (called again), as the best of -repeat runs.
+
+Results can be written as JSON with -out and compared with an earlier run with
+-compare; the exit status is 1 when a path got more than -tolerance slower.
+
+    python benchmarks/bench_paths.py [-rows 1000 10000 100000 1000000] [-repeat 3] [-storage csv] [-out results.json] [-compare old.json]
+"""
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import logging
+import itertools
+import argparse
+import platform
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import write_timesheet
+
+try:
+    import tkinter  # only imported by tinker, no display is needed
+except ImportError:
+    # a stand-in for systems without Tk, the benchmarked methods never touch a widget
+    tkinter = sys.modules["tkinter"] = types.ModuleType("tkinter")
+    tkinter.ttk = sys.modules["tkinter.ttk"] = types.ModuleType("tkinter.ttk")
+    tkinter.messagebox = sys.modules["tkinter.messagebox"] = types.ModuleType("tkinter.messagebox")
+    tkinter.__getattr__ = tkinter.ttk.__getattr__ = lambda name: type(name, (), {})
+
+import timer
+import tinker
+import search
+import storage
+import reporting
+import timesheet
+import summary_cache
+from sync import SyncWorker
+
+NOISE_FLOOR = 0.001  # seconds
+PATHS = ("get_descriptions_with_durations", "get_unique_data", "last_descriptions_from_csv", "display_timesheet", "save")
+
+
+class Screen:
+    """Enough of a curses window for display_timesheet"""
+
+    def __init__(self, rows=50, columns=200):
+        self.rows, self.columns = rows, columns
+        self.drawn = 0
+
+    def getmaxyx(self):
+        return self.rows, self.columns
+
+    def addstr(self, y, x, text, attr=0):
+        self.drawn += 1
+
+
+def reset_caches(directory):
+    """Forget every in-memory and on-disk cache of the timesheet"""
+    for cache in (storage._stores, timesheet._indexes, summary_cache._summaries, search._searches, reporting._columns):
+        cache.clear()
+    for name in os.listdir(directory):
+        if name.startswith(".timesheet.csv."):
+            os.remove(os.path.join(directory, name))
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def bench_rows(directory, rows, backend, repeat):
+    """Return {path: {"cold": seconds, "warm": seconds}} for a timesheet of rows rows,
+    the best of repeat runs each"""
+    local_path = os.path.join(directory, "timesheet.csv")
+    remote_dir = os.path.join(directory, "remote")
+    os.makedirs(remote_dir, exist_ok=True)
+    write_timesheet(local_path, rows)
+    shutil.copyfile(local_path, os.path.join(remote_dir, "timesheet.csv"))
+
+    tinker.properties = {"timesheet_path": local_path, "storage": backend}
+    timer.storage_backend = backend
+    app = tinker.TimesheetApp.__new__(tinker.TimesheetApp)  # no window, only the data methods are used
+    calls = {
+        # the rows the Summary window inserts before it is shown
+        "get_descriptions_with_durations": lambda: list(itertools.islice(app.get_descriptions_with_durations(),
+                                                                         tinker.SummaryTable.CHUNK_SIZE)),
+        "get_unique_data": lambda: app.get_unique_data(),
+        "last_descriptions_from_csv": lambda: timer.last_descriptions_from_csv(10),
+        "display_timesheet": lambda: timer.display_timesheet(Screen()),
+    }
+    results = {}
+    for name, call in calls.items():
+        cold = []
+        for _ in range(repeat):
+            reset_caches(directory)
+            cold.append(timed(call))
+        results[name] = {"cold": min(cold), "warm": min(timed(call) for _ in range(repeat))}
+
+    def save(worker, i):
+        worker.save(timesheet.Entry.from_row([f"2099-01-01 00:00:{i:02d}", "00:00:01", f"benchmark entry {i}", "benchmark"]))
+        worker.wait()
+
+    cold, warm = [], []
+    for i in range(repeat):
+        reset_caches(directory)
+        worker = SyncWorker({"host": "local", "path": remote_dir, "remote_save": "true"}, local_path)
+        cold.append(timed(save, worker, 2 * i))
+        warm.append(timed(save, worker, 2 * i + 1))
+    results["save"] = {"cold": min(cold), "warm": min(warm)}
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against baseline and return the paths that got slower than tolerance"""
+    slower = []
+    for rows, paths in results.items():
+        for name, timings in paths.items():
+            for kind, seconds in timings.items():
+                before = baseline.get(rows, {}).get(name, {}).get(kind)
+                if not before:
+                    continue
+                change = seconds / before - 1
+                flag = ""
+                # below NOISE_FLOOR timings are too noisy to call a regression
+                if change > tolerance and seconds > NOISE_FLOOR:
+                    slower.append(f"{name} ({kind}, {rows} rows)")
+                    flag = "  SLOWER"
+                print(f"{rows:>9} {name:32} {kind:5} {before:9.4f}s -> {seconds:9.4f}s {change:+7.1%}{flag}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Front-end code path benchmark')
+    parser.add_argument('-rows', dest='rows', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('-repeat', dest='repeat', type=int, default=3, help='runs per path, the best one counts')
+    parser.add_argument('-storage', dest='storage', type=str, default='csv', choices=storage.BACKENDS)
+    parser.add_argument('-out', dest='out', type=str, default=None, help='write the results to this JSON file')
+    parser.add_argument('-compare', dest='compare', type=str, default=None, help='JSON results of an earlier run')
+    parser.add_argument('-tolerance', dest='tolerance', type=float, default=0.5, help='allowed slowdown against -compare, as a fraction')
+    args = parser.parse_args()
+    out, baseline = (path and os.path.abspath(path) for path in (args.out, args.compare))
+
+    directory = tempfile.mkdtemp(prefix="timer-bench-")
+    os.chdir(directory)  # timer.py works on ./timesheet.csv
+    logging.basicConfig(filename=os.path.join(directory, "timer.log"), force=True, level=logging.WARNING)
+    results = {}
+    try:
+        print(f"{'rows':>9} " + " ".join(f"{name[:24]:>24}" for name in PATHS) + "   (cold/warm seconds)")
+        for rows in args.rows:
+            results[str(rows)] = bench_rows(directory, rows, args.storage, args.repeat)
+            print(f"{rows:>9} " + " ".join(f"{results[str(rows)][name]['cold']:>11.4f}/{results[str(rows)][name]['warm']:<12.4f}"
+                                           for name in PATHS))
+    finally:
+        os.chdir("/")
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if out:
+        with open(out, "w") as f:
+            json.dump({"python": platform.python_version(), "storage": args.storage, "results": results}, f, indent=1)
+    if baseline:
+        with open(baseline) as f:
+            slower = compare(results, json.load(f)["results"], args.tolerance)
+        if slower:
+            print("slower than the baseline: " + ", ".join(slower))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Benchmark of the reporting rollups on synthetic timesheets up to a million rows.
+
+    python benchmarks/bench_reporting.py [-rows 10000 100000 1000000]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reporting
+from synthetic import synthetic_rows
+from timesheet import Entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reporting benchmark')
+    parser.add_argument('-rows', dest='rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print(f"numpy: {'yes' if reporting.numpy is not None else 'no, pure Python fallback'}")
+    print(f"{'rows':>9} {'load':>8} " + " ".join(f"{by:>11}" for by in reporting.GROUPINGS) + f" {'top 10':>8}")
+    for n in args.rows:
+        strings = {}
+        entries = [Entry.from_row(row, strings) for row in synthetic_rows(n)]
+        started = time.perf_counter()
+        columns = reporting.Columns().extend(entries)
+        timings = [time.perf_counter() - started]
+        for by in reporting.GROUPINGS:
+            started = time.perf_counter()
+            reporting.rollup(columns, by)
+            timings.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        reporting.top_tasks(columns, 10)
+        timings.append(time.perf_counter() - started)
+        print(f"{n:>9} {timings[0]:>7.3f}s " + " ".join(f"{t:>10.3f}s" for t in timings[1:-1]) + f" {timings[-1]:>7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
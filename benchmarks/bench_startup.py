@@ -0,0 +1,139 @@
+"""Startup benchmark: import time of both entry points and time to their first frame.
+
+Import times come from python -X importtime. The first frame is timed from spawning
+the process until the curses front-end shows its description list, or until the Tk
+window has been drawn (skipped without a display). Both run against a synthetic
+timesheet with remote sync and the update check disabled. Every measurement is the
+best of -repeat runs and is checked against BUDGETS, which are tracked across
+releases: the exit status is 1 when one is over budget.
+
+    python benchmarks/bench_startup.py [-rows 10000] [-repeat 5] [-json]
+"""
+import os
+import pty
+import sys
+import json
+import time
+import select
+import signal
+import argparse
+import tempfile
+import subprocess
+
+from synthetic import write_timesheet
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds, for a 10000 row timesheet
+BUDGETS = {
+    "python": None,
+    "import timer": 0.050,
+    "import tinker": 0.080,
+    "timer first frame": 0.250,
+    "tinker first frame": 0.500,
+}
+
+TK_FIRST_FRAME = """
+import tinker
+root = tinker.main(["-work", ".", "-remote", "false", "-update-interval", "-1"])
+root.update()
+print("first frame", flush=True)
+root.destroy()
+"""
+
+
+def environment():
+    return dict(os.environ, PYTHONPATH=REPO_DIR, TERM=os.environ.get("TERM", "xterm"))
+
+
+def time_process(args, cwd):
+    started = time.perf_counter()
+    subprocess.run(args, cwd=cwd, env=environment(), check=True, capture_output=True)
+    return time.perf_counter() - started
+
+
+def import_times(module, cwd):
+    """Return (cumulative seconds, the five slowest imports by their own time)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=cwd,
+                            env=environment(), check=True, capture_output=True, text=True)
+    total, own = None, []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        own.append((int(self_us) / 1e6, name.strip()))
+        if name.strip() == module:
+            total = int(cumulative_us) / 1e6
+    return total, sorted(own, reverse=True)[:5]
+
+
+def curses_first_frame(cwd):
+    """Seconds from spawning timer.py until the description list is on screen"""
+    started = time.perf_counter()
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.chdir(cwd)
+        os.execve(sys.executable, [sys.executable, os.path.join(REPO_DIR, "timer.py")], environment())
+    output = b""
+    try:
+        while b"Select a description" not in output:
+            ready, _, _ = select.select([fd], [], [], 10)
+            if not ready:
+                raise TimeoutError("timer.py did not draw its first frame within 10s")
+            output += os.read(fd, 65536)
+        return time.perf_counter() - started
+    finally:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        os.close(fd)
+
+
+def tk_first_frame(cwd):
+    """Seconds from spawning until the Tk window has been drawn, None without a display"""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", TK_FIRST_FRAME], cwd=cwd, env=environment(),
+                            capture_output=True, text=True)
+    if "first frame" not in result.stdout:
+        return None
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup benchmark')
+    parser.add_argument('-rows', dest='rows', type=int, default=10000, help='rows in the synthetic timesheet')
+    parser.add_argument('-repeat', dest='repeat', type=int, default=5)
+    parser.add_argument('-json', dest='json', action='store_true', help='print the results as one JSON object')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        write_timesheet(os.path.join(cwd, "timesheet.csv"), args.rows)
+        with open(os.path.join(cwd, "timer.properties"), "w") as f:
+            f.write("host=local\npath=.\nremote_save=false\nupdate_check_interval=-1\n")
+
+        results, slowest = {}, {}
+        results["python"] = min(time_process([sys.executable, "-c", "pass"], cwd) for _ in range(args.repeat))
+        for module in ("timer", "tinker"):
+            runs = [import_times(module, cwd) for _ in range(args.repeat)]
+            results[f"import {module}"], slowest[module] = min(runs)
+        results["timer first frame"] = min(curses_first_frame(cwd) for _ in range(args.repeat))
+        tk_runs = [tk_first_frame(cwd) for _ in range(args.repeat)]
+        results["tinker first frame"] = None if None in tk_runs else min(tk_runs)
+
+    over = [name for name, seconds in results.items()
+            if seconds is not None and BUDGETS[name] is not None and seconds > BUDGETS[name]]
+    if args.json:
+        print(json.dumps({"rows": args.rows, "results": results, "budgets": BUDGETS, "over_budget": over}))
+    else:
+        print(f"{args.rows} rows, best of {args.repeat}")
+        for name, seconds in results.items():
+            budget = BUDGETS[name]
+            measured = "skipped (no display)" if seconds is None else f"{seconds * 1000:.1f}ms"
+            print(f"{name:20} {measured:>20} {'' if budget is None else f'budget {budget * 1000:.0f}ms':>14}"
+                  f"{'  OVER BUDGET' if name in over else ''}")
+        for module, imports in slowest.items():
+            print(f"slowest imports of {module}: " + ", ".join(f"{name} {seconds * 1000:.1f}ms" for seconds, name in imports))
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Stress test for concurrent saves from several machines.
+
+Every process plays one machine: it has its own local timesheet and journal and saves
+entries through a SyncWorker into a shared "remote" directory (host=local) at the same
+time as all the others. At the end the remote timesheet must contain every entry
+exactly once.
+
+    python benchmarks/stress_sync.py -processes 8 -entries 25 [-lock]
+"""
+import os
+import sys
+import random
+import logging
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sync
+from merge import parse_entries
+from timesheet import Entry
+
+
+def machine(number, remote_dir, entries, lock):
+    logging.basicConfig(filename=os.path.join(remote_dir, f"machine{number}.log"), level=logging.INFO,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+    sync.RETRY_DELAY = 0.1
+    local_dir = tempfile.mkdtemp(prefix=f"timer-machine{number}-")
+    properties = {"host": "local", "path": remote_dir, "remote_save": "true", "sync_retries": "50",
+                  "remote_lock": "true" if lock else "false"}
+    worker = sync.SyncWorker(properties, os.path.join(local_dir, "timesheet.csv"))
+    worker.download()
+    for i in range(entries):
+        worker.save(Entry.from_row([f"2024-01-01 {number:02d}:{i // 60:02d}:{i % 60:02d}", "00:00:01",
+                                    f"machine {number} entry {i}", "stress"]))
+        if random.random() < 0.5:
+            worker.wait()
+    worker.wait()
+    return len(worker.journal.pending())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent save stress test')
+    parser.add_argument('-processes', dest='processes', type=int, default=8)
+    parser.add_argument('-entries', dest='entries', type=int, default=25)
+    parser.add_argument('-lock', dest='lock', action='store_true', help='use the remote lock')
+    args = parser.parse_args()
+
+    remote_dir = tempfile.mkdtemp(prefix="timer-remote-")
+    with multiprocessing.Pool(args.processes) as pool:
+        pending = pool.starmap(machine, [(n, remote_dir, args.entries, args.lock) for n in range(args.processes)])
+
+    with open(os.path.join(remote_dir, "timesheet.csv"), "rb") as f:
+        entries = parse_entries(f.read())
+    ids = [entry.id for entry in entries]
+    expected = args.processes * args.entries
+    print(f"remote has {len(entries)} rows, {len(set(ids))} unique, expected {expected}; "
+          f"{sum(pending)} entries left pending; logs in {remote_dir}")
+    if len(set(ids)) != expected or len(ids) != len(set(ids)) or sum(pending):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
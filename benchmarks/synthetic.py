@@ -0,0 +1,42 @@
+"""Synthetic timesheets for the benchmarks.
+
+Rows look like the ones the timer writes: entries follow each other in time, a few
+projects get most of the time and every project has its own set of recurring
+descriptions.
+
+    python benchmarks/synthetic.py -rows 100000 -out timesheet.csv
+"""
+import csv
+import random
+import argparse
+from datetime import datetime, timedelta
+
+
+def synthetic_rows(n, projects=25, descriptions=2000, seed=0):
+    """Generate n timesheet rows ([start, duration, description, project])"""
+    rng = random.Random(seed)
+    project_names = [f"project-{i:02d}" for i in range(projects)]
+    project_weights = [1 / (i + 1) for i in range(projects)]
+    description_names = [f"task {i} {rng.choice(['review', 'meeting', 'bugfix', 'feature', 'support'])}" for i in range(descriptions)]
+    start = datetime(2015, 1, 1, 9, 0, 0)
+    for _ in range(n):
+        project = rng.choices(project_names, project_weights)[0]
+        # descriptions are grouped per project and the first ones of each group recur the most
+        description = description_names[(project_names.index(project) * 97 + int(rng.paretovariate(1.2))) % descriptions]
+        seconds = rng.randint(60, 4 * 3600)
+        yield [start.strftime("%Y-%m-%d %H:%M:%S"), "{:02d}:{:02d}:{:02d}".format(seconds // 3600, seconds % 3600 // 60, seconds % 60),
+               description, project]
+        start += timedelta(seconds=seconds + rng.randint(0, 3600))
+
+
+def write_timesheet(path, n, **kwargs):
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(synthetic_rows(n, **kwargs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write a synthetic timesheet')
+    parser.add_argument('-rows', dest='rows', type=int, default=100000)
+    parser.add_argument('-out', dest='out', type=str, default='timesheet.csv')
+    args = parser.parse_args()
+    write_timesheet(args.out, args.rows)
@@ -0,0 +1,131 @@
+"""Headless report and export commands.
+
+The timesheet is streamed entry by entry through a pipeline of generators (read, filter,
+then aggregate or format), so memory use does not grow with the size of the file and
+nothing needs a display or a terminal. Suitable for cron:
+
+    python timer.py report -by week -since 2024-01-01 -format json
+    python timer.py export -project foo -format csv > foo.csv
+"""
+import csv
+import sys
+import json
+import heapq
+import argparse
+
+from reporting import GROUPINGS, day_label, format_seconds
+from timesheet import TIMESHEET_FILE, Entry
+
+FORMATS = ("csv", "json", "table")
+COLUMNS = ("start", "duration", "description", "project")
+
+
+def read_entries(path):
+    """Yield the entries of the timesheet one at a time"""
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) >= 4:
+                yield Entry.from_row(row)
+
+
+def filter_entries(entries, project=None, description=None, since=None, until=None):
+    """Yield the entries matching every given filter; since and until are dates
+    (YYYY-MM-DD), until is inclusive"""
+    for entry in entries:
+        if project is not None and entry.project != project:
+            continue
+        if description is not None and description.lower() not in entry.description.lower():
+            continue
+        if since is not None and entry.day < since:
+            continue
+        if until is not None and entry.day > until:
+            continue
+        yield entry
+
+
+def group_key(entry, by):
+    if by == "project":
+        return entry.project
+    if by == "description":
+        return entry.description
+    return day_label(entry.day, by)
+
+
+def aggregate(entries, by, top=None):
+    """Yield (group, seconds, entries) for the entries grouped by day, week, month,
+    project or description. Only one running total per group is kept."""
+    totals = {}
+    for entry in entries:
+        key = group_key(entry, by)
+        total = totals.get(key)
+        if total is None:
+            total = totals[key] = [0, 0]
+        total[0] += entry.seconds
+        total[1] += 1
+    groups = ((key, seconds, entries) for key, (seconds, entries) in totals.items())
+    if top is not None:
+        yield from heapq.nlargest(top, groups, key=lambda group: group[1])
+    else:
+        yield from sorted(groups)
+
+
+def write_records(records, header, output_format, out, widths):
+    """Write records (sequences matching header) as csv, json or a table with the
+    given column widths, one at a time"""
+    if output_format == "csv":
+        writer = csv.writer(out)
+        writer.writerow(header)
+        writer.writerows(records)
+    elif output_format == "json":
+        # a JSON array written element by element so it never has to be held in memory
+        out.write("[")
+        for i, record in enumerate(records):
+            out.write(",\n " if i else "\n ")
+            out.write(json.dumps(dict(zip(header, record))))
+        out.write("\n]\n")
+    else:
+        line = " ".join("{:%d.%d}" % (w, w) for w in widths)
+        out.write(line.format(*header) + "\n")
+        out.write(" ".join("-" * w for w in widths) + "\n")
+        for record in records:
+            out.write(line.format(*(str(value) for value in record)) + "\n")
+
+
+def add_filter_arguments(parser):
+    parser.add_argument('-file', dest='file', type=str, default=TIMESHEET_FILE)
+    parser.add_argument('-project', dest='project', type=str, default=None, help='only this project')
+    parser.add_argument('-description', dest='description', type=str, default=None, help='only descriptions containing this text')
+    parser.add_argument('-since', dest='since', type=str, default=None, help='first day to include (YYYY-MM-DD)')
+    parser.add_argument('-until', dest='until', type=str, default=None, help='last day to include (YYYY-MM-DD)')
+    parser.add_argument('-format', dest='format', type=str, default='table', choices=FORMATS)
+
+
+def filtered_entries(args):
+    return filter_entries(read_entries(args.file), project=args.project, description=args.description,
+                          since=args.since, until=args.until)
+
+
+def report_command(argv, out=sys.stdout):
+    """timer.py report: time totals per group"""
+    parser = argparse.ArgumentParser(prog="timer.py report", description='Summarise the timesheet')
+    add_filter_arguments(parser)
+    parser.add_argument('-by', dest='by', type=str, default='month', choices=GROUPINGS)
+    parser.add_argument('-top', dest='top', type=int, default=None, help='only show the n largest groups')
+    args = parser.parse_args(argv)
+
+    # one running total per group, grouped with the same labels as reporting.rollup
+    groups = aggregate(filtered_entries(args), args.by, top=args.top)
+    records = ((key, format_seconds(seconds), entries) for key, seconds, entries in groups)
+    write_records(records, (args.by, "duration", "entries"), args.format, out, (40, 12, 8))
+
+
+def export_command(argv, out=sys.stdout):
+    """timer.py export: the matching entries themselves"""
+    parser = argparse.ArgumentParser(prog="timer.py export", description='Export timesheet entries')
+    add_filter_arguments(parser)
+    args = parser.parse_args(argv)
+
+    write_records((entry.row() for entry in filtered_entries(args)), COLUMNS, args.format, out, (19, 10, 40, 20))
+
+
+COMMANDS = {"report": report_command, "export": export_command}
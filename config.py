@@ -0,0 +1,68 @@
+import os
+
+PROPERTIES_FILE = "timer.properties"
+
+# Every property and its default when neither timer.properties nor a flag sets it, see README
+DEFAULTS = {
+    "host": "timer",
+    "path": "~/timer",
+    "remote_save": "true",
+    "remote_store": "",  # local for host=local, scp otherwise (see remote_stores.get_remote_store)
+    "sync_mode": "delta",
+    "remote_lock": "false",
+    "sync_retries": "5",
+    "fsync": "always",
+    "storage": "csv",
+    "update_check_interval": "24",
+    "metrics_file": None,
+    "metrics_summary": None,
+}
+
+# Command line flag -> (property, choices, help), shared by timer.py and tinker.py
+FLAGS = {
+    "-host": ("host", None, 'ssh host (or "local") of the remote timesheet'),
+    "-hostpath": ("path", None, 'folder of the remote timesheet'),
+    "-remote": ("remote_save", ["true", "false"], 'sync the timesheet with the remote one'),
+    "-remote-store": ("remote_store", ["scp", "rsync", "sftp", "local"], 'how the remote timesheet is reached'),
+    "-update-interval": ("update_check_interval", None, 'hours between checks for a new version, negative to disable'),
+    "-storage": ("storage", ["csv", "sqlite"], 'answer timesheet queries from the csv file or an indexed sqlite copy of it'),
+    "-metrics": ("metrics_file", None, 'append the duration, bytes and rows of every sync, parse and update check to this JSON lines file'),
+    "-metrics-summary": ("metrics_summary", None, 'write totals per phase to this file on exit'),
+    "-sync": ("sync_mode", ["delta", "full"], 'only transfer new rows (delta) or always copy the whole timesheet (full)'),
+    "-fsync": ("fsync", ["always", "rewrites", "never"], 'flush appends and rewrites of the timesheet to disk (always), only rewrites, or leave it to the OS (never)'),
+}
+
+
+def parse_properties(filename):
+    properties = {}
+    with open(filename, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            key, value = line.split("=", 1)
+            properties[key] = value
+    return properties
+
+
+def add_property_flags(parser):
+    """Add FLAGS to an argparse parser, each overriding its property when given"""
+    for flag, (key, choices, help) in FLAGS.items():
+        parser.add_argument(flag, dest=key, type=str, default=None, choices=choices, help=help)
+
+
+def load_properties(directory=".", args=None):
+    """The properties of the timesheet in directory: DEFAULTS, overridden by the
+    directory's timer.properties if it has one, overridden by the flags given in args
+    (parsed by a parser set up with add_property_flags)"""
+    properties = dict(DEFAULTS)
+    path = os.path.join(directory, PROPERTIES_FILE)
+    if os.path.exists(path):
+        properties.update(parse_properties(path))
+    for key, choices, help in FLAGS.values():
+        value = getattr(args, key, None)
+        if value is not None:
+            properties[key] = value
+    properties["workdir"] = directory
+    properties["timesheet_path"] = os.path.join(directory, "timesheet.csv")
+    return properties
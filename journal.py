@@ -0,0 +1,95 @@
+import os
+import json
+import logging
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only the threads of one process are kept apart
+    fcntl = None
+
+
+def journal_path(timesheet_path):
+    """Pending entries are kept next to the timesheet as .<name>.pending"""
+    directory, name = os.path.split(timesheet_path)
+    return os.path.join(directory, f".{name}.pending")
+
+
+class Journal:
+    """Write-ahead journal of time entries that have not reached the remote timesheet yet.
+
+    Every entry is written as one JSON line and fsync'd before save returns, so an entry
+    survives a failed or hung upload, a download that replaces the local timesheet, or
+    the process being killed. Entries are only removed once an upload containing them
+    succeeded.
+
+    Several processes can share a journal (timer.py and tinker.py running in the same
+    work directory), so every read and write holds an flock on .<name>.pending.lock,
+    a file that is never removed or replaced, besides the lock between threads.
+    """
+
+    def __init__(self, timesheet_path):
+        self.path = journal_path(timesheet_path)
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            with open(f"{self.path}.lock", "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+                yield
+
+    def append(self, *entries):
+        """Journal one or more entries with a single write and fsync"""
+        records = [{"id": entry.id, "row": entry.row()} for entry in entries]
+        with self._locked():
+            with open(self.path, "a") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+        logging.info(f"journaled {'entry' if len(records) == 1 else 'entries'} {', '.join(record['id'] for record in records)}")
+
+    def pending(self):
+        """Return the pending entries as a list of {"id", "row"} records, oldest first.
+        Entry.from_row(record["row"]) gives back the entry."""
+        with self._locked():
+            return self._read()
+
+    def _read(self):
+        records = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a write interrupted half way, the entry was never acknowledged
+                        logging.warning(f"skipping damaged line in {self.path}")
+                        continue
+                    records.setdefault(record["id"], record)
+        except FileNotFoundError:
+            pass
+        return list(records.values())
+
+    def remove(self, ids):
+        """Drop the entries with the given ids once they are safely on the remote"""
+        ids = set(ids)
+        with self._locked():
+            remaining = [record for record in self._read() if record["id"] not in ids]
+            if not remaining:
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+                return
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                for record in remaining:
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,37 @@
+import csv
+import io
+
+from timesheet import Entry
+
+
+def parse_entries(data):
+    """Parse the raw bytes of a timesheet into its entries"""
+    strings = {}
+    return [Entry.from_row(row, strings)
+            for row in csv.reader(io.StringIO(data.decode("utf-8", errors="replace"), newline="")) if len(row) >= 4]
+
+
+def merge_timesheets(remote_data, local_data):
+    """Merge two copies of a timesheet as sets of entries.
+
+    The result is the remote content, byte for byte, followed by the local entries the
+    remote does not contain, in their local order and without duplicates. Keeping the
+    remote part untouched means the merged file can be sent with a plain append, and
+    every machine that merges the same copies ends up with the same file.
+
+    Returns the merged bytes and the number of local entries that were added.
+    """
+    seen = {entry.id for entry in parse_entries(remote_data)}
+    missing = []
+    for entry in parse_entries(local_data):
+        entry_id = entry.id
+        if entry_id not in seen:
+            seen.add(entry_id)
+            missing.append(entry)
+    if not missing:
+        return remote_data, 0
+    out = io.StringIO()
+    csv.writer(out).writerows(entry.row() for entry in missing)
+    if remote_data and not remote_data.endswith(b"\n"):
+        remote_data += b"\n"
+    return remote_data + out.getvalue().encode("utf-8"), len(missing)
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import atexit
+import logging
+import functools
+import threading
+import contextlib
+
+
+class Metrics:
+    """Timings of the phases that can make the timer feel slow: downloads, uploads,
+    the update check, parsing the timesheet and building the summary.
+
+    Every phase is logged with its duration and fields such as bytes transferred and
+    rows parsed. With an events file configured each phase is also appended to it as
+    a JSON line; with a summary file configured the totals per phase are written to
+    it as "<phase>.<field> <value>" lines when the process exits.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events_path = None
+        self.summary_path = None
+        self.totals = {}  # phase -> {"count", "failures", "seconds", "max_seconds", numeric fields summed}
+
+    def configure(self, events_path=None, summary_path=None):
+        self.events_path = events_path
+        if summary_path and not self.summary_path:
+            atexit.register(self.write_summary)
+        self.summary_path = summary_path
+
+    @contextlib.contextmanager
+    def phase(self, name, **fields):
+        """Time the with block as phase name. The block can add fields (bytes, rows) to
+        the dict it is given, and set "ok" to False for failures that do not raise."""
+        fields["ok"] = True
+        started = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as e:
+            fields["ok"] = False
+            fields["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started, fields)
+
+    def record(self, name, seconds, fields):
+        logging.info(f"{name} took {seconds:.3f}s " + " ".join(f"{key}={value}" for key, value in fields.items()))
+        with self.lock:
+            total = self.totals.setdefault(name, {"count": 0, "failures": 0, "seconds": 0.0, "max_seconds": 0.0})
+            total["count"] += 1
+            total["failures"] += not fields.get("ok", True)
+            total["seconds"] += seconds
+            total["max_seconds"] = max(total["max_seconds"], seconds)
+            for key, value in fields.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    total[key] = total.get(key, 0) + value
+            if self.events_path:
+                event = {"time": round(time.time(), 3), "phase": name, "seconds": round(seconds, 6), **fields}
+                try:
+                    with open(self.events_path, "a") as f:
+                        f.write(json.dumps(event) + "\n")
+                except OSError as e:
+                    logging.warning(f"could not write metrics to {self.events_path}: {e}")
+
+    def write_summary(self):
+        with self.lock:
+            lines = [f"{name}.{key} {round(value, 6)}" for name, total in sorted(self.totals.items())
+                     for key, value in total.items()]
+        tmp_path = f"{self.summary_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, self.summary_path)
+        except OSError as e:
+            logging.warning(f"could not write metrics summary to {self.summary_path}: {e}")
+
+
+metrics = Metrics()
+phase = metrics.phase
+
+
+def configure_metrics(properties, directory="."):
+    """Turn on the metrics files named by metrics_file (JSON lines) and metrics_summary,
+    relative to directory"""
+    events_path, summary_path = properties.get('metrics_file'), properties.get('metrics_summary')
+    metrics.configure(events_path and os.path.join(directory, events_path),
+                      summary_path and os.path.join(directory, summary_path))
+
+
+_profilers = []  # one per profiled thread, the first is the UI thread's; empty unless profiling
+_profilers_lock = threading.Lock()
+_thread_profiler = threading.local()
+
+
+def start_profile(path):
+    """Profile the rest of the session with cProfile and write the stats to path on
+    exit, for python -m pstats or snakeviz. The UI thread is profiled throughout; the
+    background threads while they run functions wrapped with profiled()."""
+    import cProfile
+    profiler = cProfile.Profile()
+    _profilers.append(profiler)
+
+    def write_profile():
+        import pstats
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        with _profilers_lock:
+            others = _profilers[1:]
+        for other in others:
+            try:
+                stats.add(other)
+            except Exception as e:  # a background thread still in a task at exit
+                logging.warning(f"could not add a background thread's profile: {e}")
+        stats.dump_stats(path)
+        logging.info(f"wrote profile of {len(others) + 1} threads to {path}")
+
+    atexit.register(write_profile)
+    profiler.enable()
+
+
+def profiled(function):
+    """Run function under its thread's own profiler while start_profile is profiling
+    the session, so downloads, uploads and the update check on the background threads
+    show up in the profile too; cProfile only sees the thread that enabled it."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _profilers:
+            return function(*args, **kwargs)
+        profiler = getattr(_thread_profiler, "profiler", None)
+        if profiler is None:
+            import cProfile
+            profiler = _thread_profiler.profiler = cProfile.Profile()
+            with _profilers_lock:
+                _profilers.append(profiler)
+        profiler.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.disable()
+    return wrapper
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import contextlib
+import subprocess
+
+from merge import merge_timesheets
+from metrics import phase
+from remote_stores import file_prefix_sha1, get_remote_store, local_size
+from timesheet import TimesheetWriter
+
+LOCK_TIMEOUT = 30  # seconds to wait for the remote lock before syncing without it
+ETAG_WINDOW = 4096  # bytes before the synced size that must be unchanged locally for a cached tag to count
+
+
+def etag_path(local_path):
+    """The remote file's tag is cached next to the timesheet as .<name>.etag"""
+    directory, name = os.path.split(local_path)
+    return os.path.join(directory, f".{name}.etag")
+
+
+class ETagCache:
+    """The remote file's tag as of the last sync that left the remote copy equal to the
+    start of the local one.
+
+    The tag comes from the store's stat() (size and mtime, plus the inode where the
+    store has one), so while stat returns the same tag the remote file is known to be
+    unchanged and neither a checksum nor a copy of it is needed: an unchanged timesheet
+    costs one stat. The sha1 of the last ETAG_WINDOW bytes the two copies shared is
+    kept as well, so a local copy rewritten in the meantime is not trusted. Written like
+    the timer checkpoint, atomically but not fsync'd; losing it costs one probe.
+    """
+
+    def __init__(self, local_path, location):
+        self.path = etag_path(local_path)
+        self.local_path = local_path
+        self.location = location  # the store and remote path the tag belongs to
+        self.cached = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"ignoring damaged remote tag cache {self.path}: {e}")
+            return None
+        return cached if isinstance(cached, dict) and cached.get("location") == self.location else None
+
+    def _window_sha1(self, size):
+        """sha1 of the local bytes just before size, None if the local file is shorter"""
+        start = max(0, size - ETAG_WINDOW)
+        try:
+            with open(self.local_path, "rb") as f:
+                f.seek(start)
+                data = f.read(size - start)
+        except FileNotFoundError:
+            return None
+        return hashlib.sha1(data).hexdigest() if len(data) == size - start else None
+
+    def matches(self, stat):
+        """Whether the remote (size, tag) is the cached one and the local copy still starts with it"""
+        if stat is None or self.cached is None:
+            return False
+        size, tag = stat
+        return (self.cached.get("tag") == tag and self.cached.get("size") == size
+                and self._window_sha1(size) == self.cached.get("window"))
+
+    def save(self, stat):
+        size, tag = stat
+        cached = {"location": self.location, "tag": tag, "size": size, "window": self._window_sha1(size)}
+        if cached == self.cached or cached["window"] is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(cached, f)
+            os.replace(tmp_path, self.path)
+            self.cached = cached
+        except OSError as e:
+            logging.warning(f"could not cache the remote timesheet's tag: {e}")
+
+
+class RemoteTimesheet:
+    """Keeps the local timesheet.csv in sync with the remote copy, kept by any of the
+    stores in remote_stores.py (scp, rsync, sftp or a local directory).
+
+    The timesheet is append-only, so in "delta" sync mode only the rows one side is
+    missing are transferred: the remote is first asked for its size and a checksum of
+    the prefix both copies should share, then either the remote tail is fetched or the
+    local tail is appended remotely. When the two copies have diverged, e.g. because
+    two machines saved at the same time, the remote copy is fetched and merged with the
+    local one as sets of entries (see merge.merge_timesheets); the remote is still only
+    ever appended to, so concurrent saves from several machines all survive. In "full"
+    sync mode the whole file is always copied and the last upload wins.
+
+    Both modes first stat the remote file: when it still has the tag cached by the last
+    sync (see ETagCache) the checksum, or in full mode the copy, is skipped.
+
+    With remote_lock=true every sync holds a lock directory next to the remote
+    timesheet, which serialises machines that sync at the same moment. A lock older
+    than LOCK_TIMEOUT is taken to be left over from a sync that died, and removed.
+    """
+
+    def __init__(self, properties, local_path):
+        self.store = get_remote_store(properties)
+        self.local_path = local_path
+        self.writer = TimesheetWriter(local_path, properties.get('fsync', 'always'))
+        self.sync_mode = properties.get('sync_mode', 'delta')
+        self.use_lock = properties.get('remote_lock', 'false') == "true"
+        self.etag = ETagCache(local_path, self.store.location)
+        self.remote_stat = None  # (size, tag) of the remote file when it was last looked at
+
+    @property
+    def bytes_received(self):
+        return self.store.bytes_received
+
+    @property
+    def bytes_sent(self):
+        return self.store.bytes_sent
+
+    def _local_size(self):
+        return local_size(self.local_path)
+
+    def _unchanged(self):
+        """Stat the remote file and return whether it is as the last sync left it"""
+        self.remote_stat = self.store.stat()
+        return self.etag.matches(self.remote_stat)
+
+    def _remember(self, size):
+        """Cache the remote tag once the remote file is known to be the first size bytes
+        of the local one. After the remote file changed it is stat'ed again."""
+        if self.remote_stat is not None and self.remote_stat[0] == size:
+            self.etag.save(self.remote_stat)
+
+    def _fetch_whole_file(self):
+        # copied next to the local timesheet and renamed over it, a failed copy leaves it as it was
+        with self.writer.rewrite() as tmp_path:
+            self.store.fetch(tmp_path, basis=self.local_path)
+
+    def _compare(self):
+        """Return (local size, remote size, whether the shorter copy is a prefix of the other)"""
+        local_size = self._local_size()
+        if self._unchanged():
+            logging.info("remote timesheet unchanged since the last sync")
+            return local_size, self.remote_stat[0], True
+        remote_size, remote_digest = self.store.probe(local_size)
+        shared = min(local_size, remote_size)
+        local_digest = file_prefix_sha1(self.local_path, shared) if local_size else hashlib.sha1().hexdigest()
+        return local_size, remote_size, local_digest == remote_digest
+
+    @contextlib.contextmanager
+    def _remote_lock(self):
+        """Hold the remote lock (an atomically created directory) while syncing. A sync
+        holds it for seconds, so a lock older than LOCK_TIMEOUT was left behind by a sync
+        that crashed or was killed, and is broken."""
+        if not self.use_lock:
+            yield
+            return
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        locked = False
+        while not locked:
+            locked = self.store.lock()
+            if not locked:
+                age = self.store.lock_age()
+                if age is not None and age > LOCK_TIMEOUT:
+                    logging.warning(f"breaking the lock on {self.store.location}, taken {age:.0f}s ago by a sync that never released it")
+                    self._break_lock()
+                elif time.monotonic() > deadline:
+                    logging.warning(f"timed out waiting for the lock on {self.store.location}, syncing without it")
+                    break
+                else:
+                    time.sleep(0.2)
+        try:
+            yield
+        finally:
+            if locked:
+                self.store.unlock()
+
+    def _break_lock(self):
+        try:
+            self.store.unlock()
+        except (subprocess.CalledProcessError, OSError):
+            pass  # another machine broke it first, the next lock() finds out who took it since
+
+    def _read_local(self):
+        try:
+            with open(self.local_path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return b""
+
+    def _merge(self):
+        """Rewrite the local timesheet as the remote one plus the local entries it is
+        missing, and return the size of the remote part"""
+        remote_data = self.store.read()
+        merged, added = merge_timesheets(remote_data, self._read_local())
+        self.writer.replace(merged)
+        logging.info(f"merged remote timesheet with {added} local entries it did not have")
+        return len(remote_data)
+
+    def _append_remote(self, offset):
+        """Append the local timesheet from offset onwards to the remote one"""
+        with open(self.local_path, "rb") as f:
+            f.seek(offset)
+            tail = f.read()
+        if tail:
+            self.store.append(tail)
+        logging.info(f"uploaded {len(tail)} new bytes of timesheet")
+
+    def download(self):
+        if self.sync_mode == 'full':
+            with self._remote_lock():
+                unchanged = self._unchanged()
+                if self.remote_stat is None:
+                    # nothing to fetch before the first upload creates it, as in delta mode
+                    logging.info("there is no remote timesheet yet, nothing to download")
+                    return
+                if unchanged and self._local_size() == self.remote_stat[0]:
+                    logging.info("remote timesheet unchanged since the last sync, not downloading it")
+                    return
+                self._fetch_whole_file()
+                self._remember(self._local_size())
+            return
+        local_size, remote_size, same_prefix = self._compare()
+        if not same_prefix:
+            logging.info("local and remote timesheet diverged, merging them")
+            self._remember(self._merge())
+        elif remote_size > local_size:
+            tail = self.store.read(local_size)
+            self.writer.append_bytes(tail)
+            logging.info(f"downloaded {len(tail)} new bytes of timesheet")
+            self._remember(local_size + len(tail))
+        else:
+            logging.info("local timesheet already has all remote rows")
+            self._remember(remote_size)
+
+    def upload(self):
+        with self._remote_lock():
+            if self.sync_mode == 'full':
+                if self._unchanged() and self._local_size() == self.remote_stat[0]:
+                    logging.info("remote timesheet already equals the local one, not uploading it")
+                    return
+                self.store.send(self.local_path)
+            else:
+                local_size, remote_size, same_prefix = self._compare()
+                if not same_prefix:
+                    logging.info("local and remote timesheet diverged, merging them")
+                    self._append_remote(self._merge())
+                elif local_size > remote_size:
+                    self._append_remote(remote_size)
+                else:
+                    logging.info("remote timesheet already has all local rows")
+                    self._remember(remote_size)
+                    return
+            # the upload changed the remote file, its new tag is cached if nobody else changed it too
+            self.remote_stat = self.store.stat()
+            self._remember(self._local_size())
+
+
+def download_timesheet(properties, local_path):
+    """Brings the local timesheet up to date with the copy on the remote system.
+    Returns False if the download failed."""
+    if not properties['remote_save'] == "true":
+        return True
+    remote = RemoteTimesheet(properties, local_path)
+    logging.info(f"Downloading latest version of timesheet...{remote.store.location}")
+    with phase("download", sync_mode=remote.sync_mode, store=remote.store.name) as fields:
+        try:
+            remote.download()
+        except (subprocess.CalledProcessError, OSError) as e:
+            logging.error(f"Downloading timesheet failed: {e}")
+            fields.update(ok=False, error=str(e))
+        fields.update(bytes_received=remote.bytes_received, bytes_sent=remote.bytes_sent)
+    return fields["ok"]
+
+
+def upload_timesheet(properties, local_path):
+    """Sends the rows of the local timesheet that the remote system does not have yet.
+    Returns False if the upload failed."""
+    if not properties['remote_save'] == "true":
+        return True
+    logging.info(f"Uploading latest version of timesheet...")
+    remote = RemoteTimesheet(properties, local_path)
+    with phase("upload", sync_mode=remote.sync_mode, store=remote.store.name) as fields:
+        try:
+            remote.upload()
+        except (subprocess.CalledProcessError, OSError) as e:
+            logging.error(f"Uploading timesheet failed: {e}")
+            fields.update(ok=False, error=str(e))
+        fields.update(bytes_received=remote.bytes_received, bytes_sent=remote.bytes_sent)
+    return fields["ok"]
@@ -0,0 +1,470 @@
+import os
+import re
+import atexit
+import shlex
+import shutil
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+
+from timesheet import TimesheetWriter
+
+LOCAL_HOSTS = ("", "local", "localhost")
+CONTROL_PERSIST = 60  # seconds an idle shared ssh connection stays open
+
+
+class SshConnection:
+    """A multiplexed ssh master connection to a host.
+
+    The master is started the first time a command needs it and is shared by every
+    ssh, scp and rsync call of the process through its control socket, so only the
+    first transfer pays for the TCP and ssh handshakes. If the master cannot be started
+    the commands simply open their own connections as before. The master exits by
+    itself once it has been idle for CONTROL_PERSIST seconds, so one left behind by a
+    process that was killed does not linger; the next command then starts it again.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.control_dir = tempfile.mkdtemp(prefix="timer-ssh-")
+        self.control_path = os.path.join(self.control_dir, "%C")
+        self.started = False
+        self.last_used = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the master unless it is running, it exits after CONTROL_PERSIST idle seconds"""
+        with self.lock:
+            idle = time.monotonic() - self.last_used
+            self.last_used = time.monotonic()
+            if self.started and (idle < CONTROL_PERSIST or self._running()):
+                return
+            self.started = True
+            logging.info(f"Opening shared ssh connection to {self.host}")
+            # -f backgrounds the master once it is authenticated, -N keeps it idle; BatchMode
+            # fails instead of prompting for a password nobody can type
+            result = subprocess.run(["ssh", "-M", "-N", "-f", "-o", f"ControlPath={self.control_path}",
+                                     "-o", f"ControlPersist={CONTROL_PERSIST}", "-o", "BatchMode=yes", self.host],
+                                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if result.returncode != 0:
+                logging.warning(f"could not open shared ssh connection to {self.host}, using one connection per transfer")
+
+    def _running(self):
+        return subprocess.run(["ssh", "-o", f"ControlPath={self.control_path}", "-O", "check", self.host],
+                              stdin=subprocess.DEVNULL, capture_output=True).returncode == 0
+
+    def options(self):
+        """ssh/scp options that route a command through the shared connection"""
+        self.start()
+        return ["-o", f"ControlPath={self.control_path}"]
+
+    def close(self):
+        if self.started:
+            subprocess.run(["ssh", "-o", f"ControlPath={self.control_path}", "-O", "exit", self.host],
+                           stdin=subprocess.DEVNULL, capture_output=True)
+            logging.info(f"Closed shared ssh connection to {self.host}")
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+
+
+_connections = {}
+_sftp_clients = {}
+_connections_lock = threading.Lock()
+
+
+def get_connection(host):
+    """Return the shared ssh connection to host"""
+    with _connections_lock:
+        connection = _connections.get(host)
+        if connection is None:
+            connection = _connections[host] = SshConnection(host)
+        return connection
+
+
+def open_sftp(host):
+    """Connect to host with the user, port and keys ~/.ssh/config gives it, checking its
+    host key against known_hosts, and return (ssh client, sftp client)"""
+    try:
+        import paramiko  # optional, only needed for remote_store=sftp
+    except ImportError:
+        raise OSError("remote_store=sftp needs paramiko (pip install paramiko)")
+    config_path = os.path.expanduser("~/.ssh/config")
+    options = paramiko.SSHConfig.from_path(config_path).lookup(host) if os.path.exists(config_path) else {}
+    client = paramiko.SSHClient()
+    client.load_system_host_keys()
+    logging.info(f"Opening sftp connection to {host}")
+    try:
+        client.connect(options.get("hostname", host), port=int(options.get("port", 22)),
+                       username=options.get("user"), key_filename=options.get("identityfile"))
+        return client, client.open_sftp()
+    except paramiko.SSHException as e:
+        client.close()
+        raise OSError(f"could not open sftp connection to {host}: {e}")
+
+
+def get_sftp(host):
+    """Return the shared sftp client for host"""
+    with _connections_lock:
+        if host not in _sftp_clients:
+            _sftp_clients[host] = open_sftp(host)
+        return _sftp_clients[host][1]
+
+
+@atexit.register
+def close_connections():
+    """Tear down every shared ssh and sftp connection, called automatically on exit"""
+    with _connections_lock:
+        for connection in _connections.values():
+            connection.close()
+        _connections.clear()
+        for client, sftp in _sftp_clients.values():
+            client.close()
+        _sftp_clients.clear()
+
+
+def remote_file_path(properties):
+    return f"{properties['path'].rstrip('/')}/timesheet.csv"
+
+
+def shell_path(path):
+    """Quote a path for a remote shell, keeping a leading ~ so the shell expands it"""
+    if path.startswith("~/"):
+        return "~/" + shlex.quote(path[2:])
+    return shlex.quote(path)
+
+
+def file_prefix_sha1(path, length):
+    """sha1 of the first length bytes of a local file"""
+    hasher = hashlib.sha1()
+    with open(path, "rb") as f:
+        while length > 0:
+            chunk = f.read(min(length, 1 << 20))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            length -= len(chunk)
+    return hasher.hexdigest()
+
+
+def local_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+class ScpStore:
+    """The remote timesheet on an ssh host.
+
+    Every store offers the same operations on the remote file, which is only ever
+    appended to or replaced as a whole: stat() returns its size and a tag that changes
+    whenever the file does, probe() its size and the sha1 of a prefix, read() the bytes
+    from an offset, append() adds bytes, fetch() and send() copy the whole file, and
+    lock()/unlock() create and remove a lock directory next to it, whose age in seconds
+    lock_age() returns (None without a lock). A missing file reads
+    as empty. Failures raise OSError or subprocess.CalledProcessError.
+
+    Here they are shell commands run over the shared ssh connection (see SshConnection)
+    and whole files are copied with scp. With a local host the commands run in a local
+    shell instead.
+    """
+
+    name = "scp"
+
+    def __init__(self, properties):
+        self.host = properties.get('host', '')
+        self.path = remote_file_path(properties)
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    @property
+    def location(self):
+        return f"{self.name}:{self.host}:{self.path}"
+
+    @property
+    def is_local(self):
+        return self.host in LOCAL_HOSTS
+
+    def _ssh_options(self):
+        return get_connection(self.host).options()
+
+    def _remote(self, path):
+        """The path as scp and rsync name it"""
+        return os.path.expanduser(path) if self.is_local else f"{self.host}:{path}"
+
+    def _run(self, command, input=None):
+        """Run a shell command on the remote system and return its output"""
+        if self.is_local:
+            args = ["sh", "-c", command]
+        else:
+            args = ["ssh", *self._ssh_options(), self.host, command]
+        result = subprocess.run(args, input=input, capture_output=True)
+        self.bytes_sent += len(input or b"")
+        self.bytes_received += len(result.stdout)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, args, result.stdout, result.stderr)
+        return result.stdout
+
+    def stat(self):
+        path = shell_path(self.path)
+        # GNU stat, then BSD stat; the inode changes when the file is replaced by a rename
+        fields = self._run(f"if [ -f {path} ]; then stat -c '%s %Y %i' {path} 2>/dev/null || "
+                           f"stat -f '%z %m %i' {path}; fi").decode().split()
+        if not fields:
+            return None
+        return int(fields[0]), "-".join(fields)
+
+    def probe(self, length):
+        """Return the remote size and the sha1 of the first length bytes of the remote file"""
+        path = shell_path(self.path)
+        command = (f"if [ -f {path} ]; then wc -c < {path}; else echo 0; fi; "
+                   f"if [ -f {path} ]; then head -c {length} {path}; fi | "
+                   f"(sha1sum 2>/dev/null || shasum)")
+        size, digest = self._run(command).decode().split()[:2]
+        return int(size), digest
+
+    def read(self, offset=0):
+        path = shell_path(self.path)
+        return self._run(f"if [ -f {path} ]; then tail -c +{offset + 1} {path}; fi")
+
+    def append(self, data):
+        self._run(f"cat >> {shell_path(self.path)}", input=data)
+
+    def fetch(self, tmp_path, basis=None):
+        """Copy the remote file to tmp_path; basis is the local copy, if a store can use it"""
+        subprocess.run(["scp", *self._scp_options(), self._remote(self.path), tmp_path], check=True)
+        self.bytes_received += local_size(tmp_path)
+
+    def send(self, local_path):
+        # copied next to the remote file and renamed over it, other machines never read half of it
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        subprocess.run(["scp", *self._scp_options(), local_path, self._remote(tmp_path)], check=True)
+        self._run(f"mv -f {shell_path(tmp_path)} {shell_path(self.path)}")
+        self.bytes_sent += local_size(local_path)
+
+    def _scp_options(self):
+        return [] if self.is_local else self._ssh_options()
+
+    def lock(self):
+        """Take the lock if it is free, return whether it was"""
+        try:
+            self._run(f"mkdir {shell_path(self.path + '.lock')}")
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def unlock(self):
+        self._run(f"rmdir {shell_path(self.path + '.lock')}")
+
+    def lock_age(self):
+        path = shell_path(self.path + '.lock')
+        # measured against the remote clock, the local one may be set differently
+        age = self._run(f"if [ -d {path} ]; then echo $(( $(date +%s) - "
+                        f"$(stat -c %Y {path} 2>/dev/null || stat -f %m {path}) )); fi").decode().strip()
+        return int(age) if age else None
+
+
+class RsyncStore(ScpStore):
+    """Like ScpStore, but whole files are copied with rsync, which only transfers the
+    blocks that differ from the copy already on the receiving side and renames the
+    result into place itself. Full sync mode then costs about as much as the rows that
+    changed instead of the whole timesheet."""
+
+    name = "rsync"
+
+    def _rsync(self, source, destination, *options):
+        args = ["rsync", "--no-whole-file", "--stats", *options, source, destination]
+        if not self.is_local:
+            args[1:1] = ["-e", shlex.join(["ssh", *self._ssh_options()])]
+        result = subprocess.run(args, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, args, result.stdout, result.stderr)
+        # rsync reports what it sent and received, e.g. "Total bytes received: 1,234"
+        for direction in ("sent", "received"):
+            match = re.search(rf"Total bytes {direction}: ([\d,]+)", result.stdout)
+            if match:
+                setattr(self, f"bytes_{direction}", getattr(self, f"bytes_{direction}") + int(match[1].replace(",", "")))
+
+    def fetch(self, tmp_path, basis=None):
+        # start from the local copy so that only the blocks it is missing are transferred
+        if basis and os.path.exists(basis):
+            shutil.copyfile(basis, tmp_path)
+        self._rsync(self._remote(self.path), tmp_path, "--inplace")
+
+    def send(self, local_path):
+        self._rsync(local_path, self._remote(self.path))
+
+
+class SftpStore:
+    """The remote timesheet on an ssh host, over SFTP (with paramiko) instead of a remote
+    shell, for hosts that only allow SFTP.
+
+    SFTP cannot hash a file on the server, so probe() reads the remote prefix; the
+    sync only probes when the remote file changed since the last sync, though (see
+    remote.ETagCache), and an unchanged one costs one stat.
+    """
+
+    name = "sftp"
+
+    def __init__(self, properties):
+        self.host = properties.get('host', '')
+        path = remote_file_path(properties)
+        # SFTP does not expand ~, but relative paths start in the login directory
+        self.path = path[2:] if path.startswith("~/") else path
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    @property
+    def location(self):
+        return f"{self.name}:{self.host}:{self.path}"
+
+    @property
+    def sftp(self):
+        return get_sftp(self.host)
+
+    def stat(self):
+        try:
+            attributes = self.sftp.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return attributes.st_size, f"{attributes.st_size}-{attributes.st_mtime}"
+
+    def probe(self, length):
+        hasher = hashlib.sha1()
+        stat = self.stat()
+        remaining = min(length, stat[0]) if stat else 0
+        if remaining:
+            with self.sftp.open(self.path, "rb") as f:
+                f.prefetch(remaining)
+                while remaining > 0:
+                    chunk = f.read(min(remaining, 1 << 20))
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    remaining -= len(chunk)
+                    self.bytes_received += len(chunk)
+        return (stat[0] if stat else 0), hasher.hexdigest()
+
+    def read(self, offset=0):
+        try:
+            with self.sftp.open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return b""
+        self.bytes_received += len(data)
+        return data
+
+    def append(self, data):
+        with self.sftp.open(self.path, "ab") as f:
+            f.write(data)
+        self.bytes_sent += len(data)
+
+    def fetch(self, tmp_path, basis=None):
+        self.sftp.get(self.path, tmp_path)
+        self.bytes_received += local_size(tmp_path)
+
+    def send(self, local_path):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        self.sftp.put(local_path, tmp_path)
+        self.sftp.posix_rename(tmp_path, self.path)
+        self.bytes_sent += local_size(local_path)
+
+    def lock(self):
+        try:
+            self.sftp.mkdir(f"{self.path}.lock")
+            return True
+        except OSError:
+            return False
+
+    def unlock(self):
+        self.sftp.rmdir(f"{self.path}.lock")
+
+    def lock_age(self):
+        # SFTP has no clock of its own, the lock's mtime is compared with the local one
+        try:
+            return time.time() - self.sftp.stat(f"{self.path}.lock").st_mtime
+        except FileNotFoundError:
+            return None
+
+
+class LocalStore:
+    """The remote timesheet in a local directory, for example a mounted share, read and
+    written directly. Appends and replacements go through TimesheetWriter with the
+    local fsync policy."""
+
+    name = "local"
+
+    def __init__(self, properties):
+        self.path = os.path.expanduser(remote_file_path(properties))
+        self.writer = TimesheetWriter(self.path, properties.get('fsync', 'always'))
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    @property
+    def location(self):
+        return f"{self.name}:{self.path}"
+
+    def stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, f"{stat.st_size}-{stat.st_mtime_ns}-{stat.st_ino}"
+
+    def probe(self, length):
+        size = local_size(self.path)
+        return size, file_prefix_sha1(self.path, min(length, size)) if size else hashlib.sha1().hexdigest()
+
+    def read(self, offset=0):
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return b""
+        self.bytes_received += len(data)
+        return data
+
+    def append(self, data):
+        self.writer.append_bytes(data)
+        self.bytes_sent += len(data)
+
+    def fetch(self, tmp_path, basis=None):
+        shutil.copyfile(self.path, tmp_path)
+        self.bytes_received += local_size(tmp_path)
+
+    def send(self, local_path):
+        with self.writer.rewrite() as tmp_path:
+            shutil.copyfile(local_path, tmp_path)
+        self.bytes_sent += local_size(local_path)
+
+    def lock(self):
+        try:
+            os.mkdir(f"{self.path}.lock")
+            return True
+        except FileExistsError:
+            return False
+
+    def unlock(self):
+        os.rmdir(f"{self.path}.lock")
+
+    def lock_age(self):
+        try:
+            return time.time() - os.stat(f"{self.path}.lock").st_mtime
+        except FileNotFoundError:
+            return None
+
+
+STORES = {"scp": ScpStore, "rsync": RsyncStore, "sftp": SftpStore, "local": LocalStore}
+
+
+def get_remote_store(properties):
+    """The store named by remote_store; without one, local for a host of "local" (or
+    empty) and scp for any other host"""
+    name = properties.get('remote_store') or ("local" if properties.get('host', '') in LOCAL_HOSTS else "scp")
+    if name not in STORES:
+        raise ValueError(f"unknown remote_store {name!r}, expected one of {', '.join(STORES)}")
+    return STORES[name](properties)
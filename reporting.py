@@ -0,0 +1,156 @@
+import functools
+from array import array
+from datetime import date
+
+from timesheet import get_index
+
+try:
+    import numpy
+except ImportError:  # numpy is optional, the rollups fall back to plain Python loops
+    numpy = None
+
+GROUPINGS = ("day", "week", "month", "project", "description")
+
+
+@functools.lru_cache(maxsize=4096)
+def iso_week(day):
+    """The ISO week (YYYY-Www) of a YYYY-MM-DD day, the day itself if it is not a date"""
+    try:
+        year, week, _ = date.fromisoformat(day).isocalendar()
+    except ValueError:
+        return day
+    return f"{year}-W{week:02d}"
+
+
+def day_label(day, by):
+    """The group of a YYYY-MM-DD day when grouping by day, week or month"""
+    if by == "month":
+        return day[:7]
+    if by == "week":
+        return iso_week(day)
+    return day
+
+
+class Columns:
+    """Timesheet entries stored column-wise for reporting.
+
+    Durations are integer seconds in an array; the day, project and description of
+    each entry are integer codes into the days, projects and descriptions lists. All
+    columns are 64 bit arrays so numpy can use them without copying.
+    """
+
+    def __init__(self):
+        self.seconds = array('q')
+        self.day = array('q')
+        self.project = array('q')
+        self.description = array('q')
+        self.days, self.projects, self.descriptions = [], [], []
+        self._codes = ({}, {}, {})
+        self.entries_read = 0
+
+    def __len__(self):
+        return len(self.seconds)
+
+    def _code(self, which, labels, value):
+        codes = self._codes[which]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(labels)
+            labels.append(value)
+        return code
+
+    def extend(self, entries):
+        """Add entries of the timesheet"""
+        for entry in entries:
+            self.seconds.append(entry.seconds)
+            self.day.append(self._code(0, self.days, entry.day))
+            self.description.append(self._code(1, self.descriptions, entry.description))
+            self.project.append(self._code(2, self.projects, entry.project))
+            self.entries_read += 1
+        return self
+
+    def keys(self, by):
+        """Return (codes, labels) grouping every entry by day, week, month, project or description"""
+        if by == "project":
+            return self.project, self.projects
+        if by == "description":
+            return self.description, self.descriptions
+        if by == "day":
+            return self.day, self.days
+        if by not in ("week", "month"):
+            raise ValueError(f"cannot group by {by}, expected one of {', '.join(GROUPINGS)}")
+        # work out the week or month once per distinct day, then map every entry through it
+        labels, label_codes, day_to_label = [], {}, array('q')
+        for day in self.days:
+            label = day_label(day, by)
+            code = label_codes.get(label)
+            if code is None:
+                code = label_codes[label] = len(labels)
+                labels.append(label)
+            day_to_label.append(code)
+        if numpy is not None:
+            codes = numpy.asarray(day_to_label, dtype=numpy.int64)[numpy.frombuffer(self.day, dtype=numpy.int64)]
+        else:
+            codes = array('q', (day_to_label[d] for d in self.day))
+        return codes, labels
+
+
+def _project_code(columns, project):
+    """Code of project, -1 if it has no entries, or None when not filtering by project"""
+    if project is None:
+        return None
+    return columns._codes[2].get(project, -1)
+
+
+def rollup(columns, by, project=None, top=None):
+    """Total seconds and number of entries per group.
+
+    Returns a list of (label, seconds, entries), ordered by label, or by seconds
+    (largest first) when top is given, in which case only the top groups are returned.
+    """
+    codes, labels = columns.keys(by)
+    only = _project_code(columns, project)
+    if numpy is not None and len(columns):
+        if isinstance(codes, array):
+            codes = numpy.frombuffer(codes, dtype=numpy.int64)
+        seconds = numpy.frombuffer(columns.seconds, dtype=numpy.int64)
+        if only is not None:
+            selected = numpy.frombuffer(columns.project, dtype=numpy.int64) == only
+            codes, seconds = codes[selected], seconds[selected]
+        totals = numpy.bincount(codes, weights=seconds, minlength=len(labels)).astype(numpy.int64).tolist()
+        counts = numpy.bincount(codes, minlength=len(labels)).tolist()
+    else:
+        totals, counts = [0] * len(labels), [0] * len(labels)
+        for code, seconds, project_code in zip(codes, columns.seconds, columns.project):
+            if only is None or project_code == only:
+                totals[code] += seconds
+                counts[code] += 1
+    result = [(labels[i], totals[i], counts[i]) for i in range(len(labels)) if counts[i]]
+    if top is not None:
+        return sorted(result, key=lambda group: group[1], reverse=True)[:top]
+    return sorted(result)
+
+
+def format_seconds(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return "{:d}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+
+def top_tasks(columns, n=10, project=None):
+    """The n descriptions with the most time booked against them"""
+    return rollup(columns, "description", project=project, top=n)
+
+
+_columns = {}
+
+
+def load_columns(path):
+    """Return the columns of the timesheet at path, only adding entries that are new
+    since the last call"""
+    index = get_index(path)
+    cached = _columns.get(path)
+    if cached is None or cached[0] is not index.entries or cached[1].entries_read > len(index.entries):
+        cached = _columns[path] = (index.entries, Columns())
+    entries, columns = cached
+    return columns.extend(entries.iter_from(columns.entries_read))
@@ -0,0 +1,103 @@
+import math
+import heapq
+
+from timesheet import get_index
+
+HALF_LIFE = 200  # entries after which the weight of a use halves when ranking
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """Search over descriptions or projects as they are typed.
+
+    Every text is indexed by the trigrams of its lower case form, and by the one and
+    two character prefixes of its words for shorter queries, so a lookup only looks at
+    texts sharing grams with the query. Texts containing the query are ranked by
+    frecency: how often they were used, with every use weighted down by how many
+    entries ago it happened. Only when no text contains the query, fuzzy matches
+    sharing most of its trigrams (typos, swapped letters) are returned instead.
+    """
+
+    def __init__(self):
+        self.seq = 0  # number of uses added so far
+        self.texts = {}  # text -> lower case text
+        self.frecency = {}  # text -> (frecency at its last use, seq of its last use)
+        self.rank = {}  # text -> log2 of its frecency now, plus a constant shared by every text
+        self.grams = {}  # trigram -> set of texts
+        self.prefixes = {}  # one or two character word prefix -> set of texts
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, text):
+        """Record a use of text, indexing it if it is new"""
+        self.seq += 1
+        if text not in self.texts:
+            lower = self.texts[text] = text.lower()
+            for gram in trigrams(f" {lower} "):
+                self.grams.setdefault(gram, set()).add(text)
+            for word in lower.split():
+                for prefix in (word[:1], word[:2]):
+                    self.prefixes.setdefault(prefix, set()).add(text)
+        frecency, last = self.frecency.get(text, (0.0, self.seq))
+        frecency = frecency * 0.5 ** ((self.seq - last) / HALF_LIFE) + 1
+        self.frecency[text] = (frecency, self.seq)
+        # every frecency halves at the same rate, so their order is that of log2(frecency) + seq / HALF_LIFE,
+        # which does not change until the text is used again
+        self.rank[text] = math.log2(frecency) + self.seq / HALF_LIFE
+
+    def search(self, query, limit=10):
+        """The best limit matches for query, best first; the most used texts for an empty query"""
+        query = query.lower().strip()
+        if not query:
+            return heapq.nlargest(limit, self.rank, key=self.rank.get)
+        if len(query) < 3:
+            # too short for trigrams, match the start of words instead
+            return heapq.nlargest(limit, self.prefixes.get(query, ()), key=self.rank.get)
+        postings = sorted((self.grams.get(gram, set()) for gram in trigrams(query)), key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        best = heapq.nlargest(limit, (text for text in candidates if query in self.texts[text]), key=self.rank.get)
+        return best or self._fuzzy(postings, limit)
+
+    def _fuzzy(self, postings, limit):
+        """Texts sharing at least half of the query's trigrams, most shared first.
+        postings are the sets of texts containing each trigram, smallest first."""
+        needed = (len(postings) + 1) // 2
+        # a text sharing needed trigrams is in at least one of the len - needed + 1 smallest sets
+        candidates = set().union(*postings[:len(postings) - needed + 1])
+        shared = {text: sum(text in posting for posting in postings) for text in candidates}
+        fuzzy = (text for text, count in shared.items() if count >= needed)
+        return heapq.nlargest(limit, fuzzy, key=lambda text: (shared[text], self.rank[text]))
+
+
+class TimesheetSearch:
+    """Search indexes over the descriptions and projects of a timesheet"""
+
+    def __init__(self):
+        self.descriptions = SearchIndex()
+        self.projects = SearchIndex()
+        self.entries_read = 0
+
+    def extend(self, entries):
+        for entry in entries:
+            self.descriptions.add(entry.description)
+            self.projects.add(entry.project)
+            self.entries_read += 1
+        return self
+
+
+_searches = {}
+
+
+def get_search(path):
+    """Return the search indexes for the timesheet at path, only adding entries that
+    are new since the last call"""
+    index = get_index(path)
+    cached = _searches.get(path)
+    if cached is None or cached[0] is not index.entries or cached[1].entries_read > len(index.entries):
+        cached = _searches[path] = (index.entries, TimesheetSearch())
+    entries, search = cached
+    return search.extend(entries.iter_from(search.entries_read))
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import logging
+
+from timesheet import Entry, format_start
+
+CHECKPOINT_INTERVAL = 30  # seconds between checkpoints of a running timer
+
+
+class Stopwatch:
+    """The time worked on one task, over any number of start/pause segments.
+
+    Durations are measured with time.monotonic(), so setting the system clock (NTP,
+    daylight saving, a manual change) does not affect them. Wall-clock time is only
+    used for the start time written to the timesheet.
+    """
+
+    def __init__(self, description, project):
+        self.description = description
+        self.project = project
+        self.started_at = None  # wall-clock time of the first start
+        self.segments = []  # seconds of every finished segment
+        self._segment_start = None  # monotonic time the running segment started
+
+    @property
+    def running(self):
+        return self._segment_start is not None
+
+    def start(self):
+        """Start timing, or resume after a pause"""
+        if self.running:
+            return
+        if self.started_at is None:
+            self.started_at = time.time()
+        self._segment_start = time.monotonic()
+
+    def pause(self):
+        if self.running:
+            self.segments.append(time.monotonic() - self._segment_start)
+            self._segment_start = None
+
+    def elapsed(self):
+        """Seconds timed so far, not counting pauses"""
+        elapsed = sum(self.segments)
+        if self.running:
+            elapsed += time.monotonic() - self._segment_start
+        return elapsed
+
+    def wall_clock_start(self):
+        """The start in the timesheet's wall-clock seconds since the epoch (see Entry)"""
+        return int(self.started_at) + time.localtime(self.started_at).tm_gmtoff
+
+    def start_time_str(self):
+        return format_start(self.wall_clock_start())
+
+    def entry(self):
+        """The timesheet entry for the time timed so far"""
+        return Entry(self.wall_clock_start(), int(self.elapsed()), self.description, self.project)
+
+    def get_state(self):
+        segments = list(self.segments)
+        if self.running:
+            segments.append(time.monotonic() - self._segment_start)
+        return {"description": self.description, "project": self.project, "started_at": self.started_at,
+                "segments": segments, "running": self.running, "saved_at": time.time()}
+
+    @classmethod
+    def from_state(cls, state):
+        """A paused stopwatch holding the time recorded in state"""
+        stopwatch = cls(state["description"], state["project"])
+        stopwatch.started_at = state["started_at"]
+        stopwatch.segments = [float(seconds) for seconds in state["segments"]]
+        return stopwatch
+
+
+def checkpoint_path(timesheet_path):
+    """The running timers are kept next to the timesheet as .<name>.running"""
+    directory, name = os.path.split(timesheet_path)
+    return os.path.join(directory, f".{name}.running")
+
+
+class Checkpoint:
+    """Snapshot of the running timers, so a crashed or killed session can be recovered.
+
+    The timers are saved when one starts, pauses or resumes and every
+    CHECKPOINT_INTERVAL seconds while any of them runs, and cleared once their entries
+    are saved to the journal. Writes replace the file atomically but are not fsync'd:
+    losing a checkpoint in a power cut costs at most the time since the previous one.
+    """
+
+    def __init__(self, timesheet_path):
+        self.path = checkpoint_path(timesheet_path)
+        self.saved_at = 0
+
+    def save(self, stopwatches):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"timers": [stopwatch.get_state() for stopwatch in stopwatches]}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"could not checkpoint the running timers: {e}")
+        self.saved_at = time.monotonic()
+
+    def due(self):
+        return time.monotonic() - self.saved_at >= CHECKPOINT_INTERVAL
+
+    def load(self):
+        """Return (stopwatch, state) for every timer left behind by an earlier session"""
+        try:
+            with open(self.path) as f:
+                states = json.load(f)["timers"]
+            return [(Stopwatch.from_state(state), state) for state in states]
+        except FileNotFoundError:
+            return []
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"ignoring damaged timer checkpoint {self.path}: {e}")
+            return []
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class TimerManager:
+    """Any number of named timers running side by side in one process.
+
+    Timers are named after their description (with a number added when two share
+    one) and kept in the order they were added. They share one checkpoint, and
+    stopping several at once returns all of their rows so they can be saved with a
+    single journal write and sync.
+    """
+
+    def __init__(self, timesheet_path):
+        self.timers = {}
+        self.checkpoint = Checkpoint(timesheet_path)
+
+    def __len__(self):
+        return len(self.timers)
+
+    def add(self, stopwatch):
+        """Add a timer and return its name, the caller starts it"""
+        base = name = stopwatch.description or "timer"
+        number = 2
+        while name in self.timers:
+            name = f"{base} ({number})"
+            number += 1
+        self.timers[name] = stopwatch
+        return name
+
+    def start(self, name):
+        self.timers[name].start()
+        self.save_checkpoint()
+
+    def pause(self, name):
+        self.timers[name].pause()
+        self.save_checkpoint()
+
+    def restore(self, stopwatch, state):
+        """Add a timer recovered from a checkpoint and return its name. It only starts
+        again if it was running when the checkpoint was saved, a paused one stays paused."""
+        name = self.add(stopwatch)
+        if state.get("running", True):
+            self.start(name)
+        else:
+            self.save_checkpoint()
+        return name
+
+    def toggle(self, name):
+        """Pause a running timer or resume a paused one"""
+        if self.timers[name].running:
+            self.pause(name)
+        else:
+            self.start(name)
+
+    @property
+    def running(self):
+        return any(stopwatch.running for stopwatch in self.timers.values())
+
+    def stop(self, names):
+        """Stop and remove the named timers, returning their timesheet entries. They stay
+        in the checkpoint until save_checkpoint is called once the entries are journaled."""
+        entries = []
+        for name in names:
+            stopwatch = self.timers.pop(name)
+            stopwatch.pause()
+            entries.append(stopwatch.entry())
+        return entries
+
+    def save_checkpoint(self):
+        if self.timers:
+            self.checkpoint.save(self.timers.values())
+        else:
+            self.checkpoint.clear()
+
+    def checkpoint_if_due(self):
+        if self.running and self.checkpoint.due():
+            self.save_checkpoint()
+
+    def next_tick(self):
+        """Seconds until the next running timer reaches a whole second, None if none runs"""
+        ticks = [1 - stopwatch.elapsed() % 1 for stopwatch in self.timers.values() if stopwatch.running]
+        return min(ticks) if ticks else None
@@ -0,0 +1,186 @@
+import csv
+import os
+import json
+import logging
+
+from metrics import phase
+from timesheet import Entry, TailReader, TimesheetWriter, get_index, parse_duration, recent_descriptions, tail_entries
+
+BACKENDS = ("csv", "sqlite")
+
+
+class CsvStore:
+    """Answers the front-ends' queries from the in-memory index of timesheet.csv.
+
+    The latest rows are read straight from the end of the file instead (see
+    timesheet.reversed_rows), so showing them never parses the whole timesheet; the
+    index is only built once a query needs every row.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def refresh(self):
+        return self
+
+    @property
+    def index(self):
+        return get_index(self.path)
+
+    def last(self, n):
+        return tail_entries(self.path, n)
+
+    def last_entry(self):
+        entries = tail_entries(self.path, 1)
+        return entries[0] if entries else None
+
+    def recent_descriptions(self, n):
+        return recent_descriptions(self.path, n)
+
+    def projects(self):
+        return self.index.projects()
+
+    def descriptions(self):
+        return self.index.descriptions()
+
+    def months(self, project=None):
+        """Per-month entries and per-project totals, optionally for a single project.
+        Returns {"YYYY-MM": {'entries': [Entry] or Entries, 'total': seconds, 'projects':
+        {project: seconds}}} in timesheet order"""
+        if not project:
+            from summary_cache import get_summary  # only needed for the Summary window
+            return get_summary(self.path).months
+        months = {}
+        index = self.index
+        for entry in (index.entries[i] for i in index.by_project.get(project, ())):
+            month = months.setdefault(entry.month, {'entries': [], 'total': 0, 'projects': {project: 0}})
+            month['entries'].append(entry)
+            month['total'] += entry.seconds
+            month['projects'][project] += entry.seconds
+        return months
+
+
+class SqliteStore:
+    """Indexed copy of timesheet.csv in an SQLite database next to it.
+
+    timesheet.csv stays the file that is synced between machines; the database is
+    brought up to date from it on refresh, importing only the rows appended since the
+    last refresh (see TailReader). Lookups by project, month and recency use indexes
+    instead of scanning every row.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            seq INTEGER PRIMARY KEY,  -- position in timesheet.csv
+            start TEXT NOT NULL,
+            month TEXT NOT NULL,
+            duration TEXT NOT NULL,
+            seconds INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            project TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_start ON entries (start);
+        CREATE INDEX IF NOT EXISTS entries_month ON entries (month, seq);
+        CREATE INDEX IF NOT EXISTS entries_project ON entries (project, month, seq);
+        CREATE INDEX IF NOT EXISTS entries_description ON entries (description, seq);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+
+    def __init__(self, path, db_path=None):
+        import sqlite3  # only imported when the sqlite backend is used
+        self.path = path
+        if db_path is None:
+            directory, name = os.path.split(path)
+            db_path = os.path.join(directory, f".{name}.sqlite")
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(self.SCHEMA)
+        self.reader = TailReader(path)
+        state = self.db.execute("SELECT value FROM meta WHERE key = 'reader'").fetchone()
+        if state:
+            self.reader.set_state(json.loads(state[0]))
+        self._stat = None
+
+    def refresh(self):
+        """Import the rows appended to timesheet.csv since the last refresh"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return self
+        stat_key = (st.st_size, st.st_mtime_ns)
+        if stat_key == self._stat:
+            return self
+        with phase("sqlite_import", path=self.path) as fields:
+            rows, full = self.reader.read()
+            self.import_rows(rows, replace=full)
+            fields.update(rows=len(rows), full=full)
+        self._stat = stat_key
+        return self
+
+    def import_rows(self, rows, replace=False):
+        with self.db:
+            if replace:
+                self.db.execute("DELETE FROM entries")
+            self.db.executemany(
+                "INSERT INTO entries (start, month, duration, seconds, description, project) VALUES (?, ?, ?, ?, ?, ?)",
+                ((row[0], row[0][:7], row[1], parse_duration(row[1]), row[2], row[3]) for row in rows if len(row) >= 4))
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('reader', ?)",
+                            (json.dumps(self.reader.get_state()),))
+        if rows:
+            logging.info(f"imported {len(rows)} rows into {'a fresh' if replace else 'the'} timesheet database")
+
+    def export_csv(self, path):
+        """Write every entry to path in the timesheet.csv format, replacing it atomically"""
+        with TimesheetWriter(path).rewrite() as tmp_path:
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerows(self.db.execute("SELECT start, duration, description, project FROM entries ORDER BY seq"))
+
+    def last(self, n):
+        rows = self.db.execute("SELECT start, duration, description, project FROM entries ORDER BY seq DESC LIMIT ?", (n,))
+        return [Entry.from_row(row) for row in reversed(rows.fetchall())]
+
+    def last_entry(self):
+        rows = self.last(1)
+        return rows[0] if rows else None
+
+    def recent_descriptions(self, n):
+        """Same as CsvStore.recent_descriptions"""
+        rows = self.db.execute("SELECT start, duration, description, project FROM entries WHERE seq IN "
+                               "(SELECT MAX(seq) FROM entries GROUP BY description) ORDER BY seq DESC LIMIT ?", (n,))
+        return [Entry.from_row(row) for row in rows]
+
+    def projects(self):
+        return [row[0] for row in self.db.execute("SELECT DISTINCT project FROM entries ORDER BY project")]
+
+    def descriptions(self):
+        return [row[0] for row in self.db.execute(
+            "SELECT description FROM entries GROUP BY description ORDER BY MAX(seq) DESC")]
+
+    def months(self, project=None):
+        """Same structure as CsvStore.months"""
+        if project:
+            rows = self.db.execute("SELECT month, start, duration, description, project FROM entries "
+                                   "WHERE project = ? ORDER BY seq", (project,))
+        else:
+            rows = self.db.execute("SELECT month, start, duration, description, project FROM entries ORDER BY seq")
+        months, strings = {}, {}
+        for row in rows:
+            entry = Entry.from_row(row[1:], strings)
+            month = months.setdefault(row[0], {'entries': [], 'total': 0, 'projects': {}})
+            month['entries'].append(entry)
+            month['total'] += entry.seconds
+            month['projects'][entry.project] = month['projects'].get(entry.project, 0) + entry.seconds
+        return months
+
+
+_stores = {}
+
+
+def get_store(path, backend="csv"):
+    """Return the shared, refreshed store for the timesheet at path"""
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown storage backend {backend}, expected one of {', '.join(BACKENDS)}")
+    store = _stores.get((path, backend))
+    if store is None:
+        store = _stores[(path, backend)] = SqliteStore(path) if backend == "sqlite" else CsvStore(path)
+    return store.refresh()
@@ -0,0 +1,137 @@
+import csv
+import io
+import os
+import hashlib
+import logging
+import pickle
+
+from metrics import phase
+from timesheet import Entries, Entry
+
+CACHE_VERSION = 2
+CHUNK_SIZE = 1 << 20
+
+
+def cache_path(timesheet_path):
+    """The summary cache lives next to the timesheet as .<name>.summary"""
+    directory, name = os.path.split(timesheet_path)
+    return os.path.join(directory, f".{name}.summary")
+
+
+class MonthlySummary:
+    """Per-month entries, totals and per-project totals of a timesheet.
+
+    The aggregates are persisted in a pickle next to the timesheet together with the
+    size and sha1 of the part of the CSV they were built from. When the CSV still starts
+    with that content only the rows after it are parsed, so only the months they touch
+    change; otherwise the summary is rebuilt from scratch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.cache_path = cache_path(path)
+        self._stat = None
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self.size = 0
+        self.digest = hashlib.sha1().hexdigest()
+        # "YYYY-MM" -> {'entries': Entries, 'total': seconds, 'projects': {project: seconds}}
+        self.months = {}
+
+    def _load(self):
+        self._loaded = True
+        try:
+            with open(self.cache_path, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get('version') == CACHE_VERSION:
+                self.size, self.digest, self.months = cached['size'], cached['digest'], cached['months']
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"ignoring unreadable summary cache {self.cache_path}: {e}")
+            self._reset()
+
+    def _save(self):
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({'version': CACHE_VERSION, 'size': self.size, 'digest': self.digest,
+                         'months': self.months}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.cache_path)
+
+    def _add_row(self, row):
+        if len(row) < 4:
+            return
+        entry = Entry.from_row(row)
+        month = self.months.get(row[0][:7])
+        if month is None:
+            month = self.months[row[0][:7]] = {'entries': Entries(), 'total': 0, 'projects': {}}
+        month['entries'].append(entry)
+        month['total'] += entry.seconds
+        month['projects'][entry.project] = month['projects'].get(entry.project, 0) + entry.seconds
+
+    def refresh(self):
+        """Bring the summary up to date with the timesheet"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset()
+            self._stat = None
+            return self
+        stat_key = (st.st_size, st.st_mtime_ns)
+        if stat_key == self._stat:
+            return self
+        with phase("summary", path=self.path, rebuilt=False, rows=0) as fields:
+            if not self._loaded:
+                self._load()
+
+            with open(self.path, "rb") as f:
+                hasher = hashlib.sha1()
+                remaining = self.size if st.st_size >= self.size else 0
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    remaining -= len(chunk)
+                if remaining or hasher.hexdigest() != self.digest:
+                    logging.info(f"timesheet {self.path} changed, rebuilding summary")
+                    fields["rebuilt"] = True
+                    self._reset()
+                    hasher = hashlib.sha1()
+                    f.seek(0)
+                tail = f.read()
+
+            # only consume complete lines, a partial last line is picked up on the next refresh
+            tail = tail[:tail.rfind(b"\n") + 1]
+            if tail:
+                hasher.update(tail)
+                touched = set()
+                rows = 0
+                for row in csv.reader(io.StringIO(tail.decode("utf-8", errors="replace"), newline="")):
+                    self._add_row(row)
+                    rows += 1
+                    if row:
+                        touched.add(row[0][:7])
+                fields.update(rows=rows, bytes=len(tail))
+                self.size += len(tail)
+                self.digest = hasher.hexdigest()
+                logging.info(f"summary updated for months {sorted(touched)}")
+                try:
+                    self._save()
+                except OSError as e:
+                    logging.warning(f"could not write summary cache {self.cache_path}: {e}")
+        self._stat = stat_key
+        return self
+
+
+_summaries = {}
+
+
+def get_summary(path):
+    """Return the shared, refreshed monthly summary for the timesheet at path"""
+    summary = _summaries.get(path)
+    if summary is None:
+        summary = _summaries[path] = MonthlySummary(path)
+    return summary.refresh()
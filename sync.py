@@ -0,0 +1,137 @@
+import time
+import queue
+import logging
+import threading
+
+from journal import Journal
+from metrics import profiled
+from timesheet import Entry, TimesheetWriter, get_index
+
+RETRY_DELAY = 2  # seconds before the first retry, doubled after every failure
+MAX_RETRY_DELAY = 60
+
+
+class SyncWorker:
+    """Runs remote downloads, saves and uploads on a background thread.
+
+    Tasks run one at a time in the order they were queued, so a save queued behind
+    the startup download still sees the downloaded rows. The UI thread never touches
+    the network: it reads status for display and calls poll() to learn which tasks
+    have finished.
+
+    Saved entries go to a local journal first. The worker then merges every pending
+    entry into the local timesheet (skipping entries it already contains) and uploads
+    it, retrying with backoff; entries leave the journal only after a successful upload.
+    """
+
+    def __init__(self, properties, local_path):
+        self.enabled = properties['remote_save'] == "true"
+        self.properties = properties
+        self.local_path = local_path
+        self.retries = int(properties.get('sync_retries', 5))
+        self.writer = TimesheetWriter(local_path, properties.get('fsync', 'always'))
+        self.journal = Journal(local_path)
+        self.status = "idle"
+        self.tasks = queue.Queue()
+        self.finished = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="timesheet-sync", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            name, task = self.tasks.get()
+            try:
+                # each task is profiled on its own, the idle wait for the next one is not
+                ok = profiled(task)() is not False
+            except Exception:
+                logging.exception(f"{name} failed")
+                ok = False
+            self.status = "idle" if ok else f"{name} failed, see timer.log"
+            self.finished.put((name, ok))
+            self.tasks.task_done()
+
+    def _download(self):
+        if not self.enabled:
+            return True
+        self.status = "Downloading timesheet..."
+        # remote (and subprocess with it) is imported here on the worker thread, not at startup
+        from remote import download_timesheet
+        return download_timesheet(self.properties, self.local_path)
+
+    def _upload(self):
+        if not self.enabled:
+            return True
+        self.status = "Uploading timesheet..."
+        from remote import upload_timesheet
+        return upload_timesheet(self.properties, self.local_path)
+
+    def _merge_pending(self, records):
+        """Append the pending entries that the local timesheet does not contain yet"""
+        index = get_index(self.local_path)
+        missing = [entry for entry in (Entry.from_row(record["row"]) for record in records) if entry not in index]
+        if missing:
+            self.status = "Saving entry..."
+            self.writer.append(missing)
+        return len(missing)
+
+    def _flush(self):
+        """Merge the journaled entries into the timesheet and upload them"""
+        delay = RETRY_DELAY
+        for attempt in range(1, self.retries + 1):
+            records = self.journal.pending()
+            if not records:
+                return True
+            # Download first in case another system has updated the timesheet since we last checked
+            downloaded = self._download()
+            added = self._merge_pending(records)
+            logging.info(f"merged {added} of {len(records)} pending entries into the timesheet")
+            # Without a fresh download the upload could replace rows we have not seen. A remote
+            # timesheet that does not exist yet downloads as empty, so the first save creates it
+            if downloaded and self._upload():
+                self.journal.remove(record["id"] for record in records)
+                return True
+            if attempt < self.retries:
+                logging.warning(f"sync attempt {attempt} failed, retrying in {delay}s")
+                self.status = f"Sync failed, retrying in {delay}s..."
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+        logging.error(f"{len(self.journal.pending())} entries are still pending, they will be uploaded next time")
+        return False
+
+    def download(self):
+        """Queue a download of the remote timesheet"""
+        self.tasks.put(("download", self._download))
+
+    def upload(self):
+        """Queue an upload of the local timesheet"""
+        self.tasks.put(("upload", self._upload))
+
+    def save(self, *entries):
+        """Journal new entries and queue them for upload, several entries are added to
+        the timesheet and uploaded together"""
+        self.journal.append(*entries)
+        self.tasks.put(("save", self._flush))
+
+    def flush(self):
+        """Queue an upload of entries left pending by an earlier session"""
+        if self.journal.pending():
+            self.tasks.put(("flush", self._flush))
+
+    @property
+    def busy(self):
+        return self.tasks.unfinished_tasks > 0
+
+    def poll(self):
+        """Return the (name, ok) of every task finished since the last call"""
+        done = []
+        while True:
+            try:
+                done.append(self.finished.get_nowait())
+            except queue.Empty:
+                return done
+
+    def wait(self, timeout=None):
+        """Block until every queued task has finished"""
+        with self.tasks.all_tasks_done:
+            if self.tasks.unfinished_tasks:
+                self.tasks.all_tasks_done.wait_for(lambda: not self.tasks.unfinished_tasks, timeout)
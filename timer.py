@@ -1,73 +1,40 @@
-import time
-import csv
+import sys
 import math
+import time
 import curses
-import subprocess
-import hashlib
 import os
 import logging
+import argparse
+
+from config import add_property_flags, load_properties
+from metrics import configure_metrics, start_profile
+from search import get_search
+from stopwatch import Stopwatch, TimerManager
+from storage import get_store
+from sync import SyncWorker
+from timesheet import get_index
+from updates import UpdateChecker
 
 # Set up logging
 logging.basicConfig(filename="timer.log", level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# Backend that answers timesheet queries (csv or sqlite), set from timer.properties in main
+storage_backend = "csv"
+
 #...
 def last_descriptions_from_csv(n=3):
-    """Retrieve the last n descriptions from the CSV file, along with their dates and durations"""
-    records = []
-    with open("timesheet.csv", newline="") as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if len(row) >= 4:
-                records.append(row[:4])  # Get the date, duration, and description
-    return records[-n:]
+    """Retrieve the last n distinct descriptions from the CSV file, most recent first, along with their dates and durations"""
+    return get_store("timesheet.csv", storage_backend).recent_descriptions(n)
 
 def display_timesheet(stdscr):
     """Display all entries from the timesheet at the bottom of the screen"""
-    try:
-        with open("timesheet.csv", newline="") as f:
-            reader = csv.reader(f)
-            y, x = stdscr.getmaxyx()  # get the height and width of the screen
-            for i, row in enumerate(reversed(list(reader))):
-                # If i is equal to or greater than y, break the loop
-                if i >= y:
-                    break
-                row_str = " | ".join(row)
-                if len(row_str) > x:
-                    row_str = row_str[:x-3] + "..."
-                stdscr.addstr(y - i - 1, 0, row_str)  # use y - i - 1 instead of y - i
-    except FileNotFoundError:
-        pass
-
+    y, x = stdscr.getmaxyx()  # get the height and width of the screen
+    for i, entry in enumerate(reversed(get_store("timesheet.csv", storage_backend).last(y))):
+        row_str = " | ".join(entry.row())
+        if len(row_str) > x:
+            row_str = row_str[:x-3] + "..."
+        stdscr.addstr(y - i - 1, 0, row_str)  # use y - i - 1 instead of y - i
 
-def check_git_pull():
-    """Performs a git pull and checks if any changes were made."""
-    result = subprocess.run(["git", "pull"], capture_output=True, text=True)
-    logging.info(f"git check results: {result}")
-    return "Already up to date." not in result.stdout
-
-def parse_properties(filename):
-    properties = {}
-    with open(filename, "r") as f:
-        for line in f:
-            key, value = line.strip().split("=", 1)
-            properties[key] = value
-    return properties
-
-def download_timesheet(properties):
-    if not properties['remote_save'] == "true":
-        return
-    """Downloads timesheet.csv from the remote system using SCP."""
-    logging.info(f"Downloading latest version of timesheet...")
-    remote_path = f"{properties['host']}:{properties['path']}/timesheet.csv"
-    subprocess.run(["scp", remote_path, "timesheet.csv"])
-
-def upload_timesheet(properties):
-    if not properties['remote_save'] == "true":
-        return
-    """Uploads timesheet.csv to the remote system using SCP."""
-    logging.info(f"Uploading latest version of timesheet...")
-    remote_path = f"{properties['host']}:{properties['path']}/timesheet.csv"
-    subprocess.run(["scp", "timesheet.csv", remote_path])
 
 def format_time(duration):
     """Format duration as hours, minutes, and seconds"""
@@ -75,173 +42,257 @@ def format_time(duration):
     minutes, seconds = divmod(remainder, 60)
     return "{:02d}:{:02d}:{:02d}".format(int(hours), int(minutes), int(seconds))
 
-def save_time(description, project, elapsed_time_seconds):
-    """Save elapsed time to CSV file"""
-    elapsed_time_hours = int(elapsed_time_seconds / 3600)
-    elapsed_time_minutes = int((elapsed_time_seconds % 3600) / 60)
-    elapsed_time_seconds = int(elapsed_time_seconds % 60)
-    elapsed_time_str = "{:02d}:{:02d}:{:02d}".format(elapsed_time_hours, elapsed_time_minutes, elapsed_time_seconds)
-    start_time_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time))
-    with open("timesheet.csv", "a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow([start_time_str, elapsed_time_str, description, project])
+def save_time(sync_worker, entries):
+    """Save the entries to the journal, the sync worker then adds them to the CSV file and uploads them together"""
+    sync_worker.save(*entries)
 
 def get_project_list():
     """Get list of projects from CSV file"""
-    project_set = set()
-    try:
-        with open("timesheet.csv", newline="") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if len(row) > 3:
-                    project_set.add(row[3])
-    except FileNotFoundError:
-        pass
+    return get_store("timesheet.csv", storage_backend).projects()
+
+def draw_line(stdscr, screen, row, text, attr=0):
+    """Draw text on a row unless it is already showing there. screen maps each row
+    to the text it currently shows, so unchanged rows are never touched."""
+    if screen.get(row) == text:
+        return
+    stdscr.move(row, 0)
+    stdscr.clrtoeol()
+    stdscr.addstr(row, 0, text, attr)
+    screen[row] = text
+
+def sync_status_text(sync_worker):
+    """What the background sync is doing"""
+    if sync_worker.busy or sync_worker.status != "idle":
+        return "Sync: {}".format(sync_worker.status)
+    return ""
+
+def wait_for_sync(stdscr, sync_worker, row):
+    """Wait for the background sync to finish while showing its progress.
+    Pressing 'q' stops waiting, unsent entries stay in the journal for the next run."""
+    spinner = "|/-\\"
+    i = 0
+    stdscr.timeout(200)
+    while sync_worker.busy:
+        stdscr.addstr(row, 0, "{} {} (press 'q' to finish later)".format(spinner[i % len(spinner)], sync_worker.status))
+        stdscr.clrtoeol()
+        stdscr.refresh()
+        i += 1
+        if stdscr.getch() == ord('q'):
+            return
+    draw_line(stdscr, {}, row, sync_status_text(sync_worker))
+    stdscr.refresh()
 
-    return sorted(list(project_set))
+def update_notice_text(update_checker):
+    """Tell the user to restart once the background update check pulled a new version"""
+    if update_checker.done.is_set() and update_checker.updated:
+        return "A new version of the script has been downloaded. Please restart the script."
+    return ""
+
+def offer_recovery(stdscr, recovered):
+    """Ask whether to carry on with the timers an earlier session left running"""
+    stdscr.clear()
+    stdscr.addstr(0, 0, "Timers were left running by an earlier session:")
+    for i, (stopwatch, state) in enumerate(recovered):
+        stdscr.addstr(i + 2, 0, "{} ({}), started at {}, {} timed up to {}{}".format(
+            stopwatch.description, stopwatch.project, stopwatch.start_time_str(), format_time(stopwatch.elapsed()),
+            time.strftime("%H:%M:%S", time.localtime(state["saved_at"])), "" if state.get("running", True) else ", paused"))
+    stdscr.addstr(len(recovered) + 3, 0, "Press 'r' to resume them or 'n' to discard them")
+    stdscr.refresh()
+    stdscr.timeout(-1)
+    while True:
+        c = stdscr.getch()
+        if c == ord('r'):
+            return True
+        if c == ord('n'):
+            return False
 
 def select_project(stdscr, project_list):
-    """Select project from list"""
-    project_list.append("Enter a new project")
+    """Select project from list, typing filters the list"""
+    query = ""
+    max_rows = max(2, stdscr.getmaxyx()[0] - 3)
+    choices = project_list[:max_rows-1] + ["Enter a new project"]
     selected_index = 0
+
+    def draw_project(i):
+        stdscr.move(i+2, 0)
+        stdscr.clrtoeol()
+        if i < len(choices):
+            stdscr.addstr(i+2, 0, "{} {}".format(">" if i == selected_index else " ", choices[i]))
+
+    def draw_query():
+        stdscr.move(0, 0)
+        stdscr.clrtoeol()
+        stdscr.addstr(0, 0, "Select a project (type to filter): {}".format(query))
+
+    stdscr.clear()
+    for i in range(len(choices)):
+        draw_project(i)
+    draw_query()
+    stdscr.refresh()
     while True:
-        stdscr.clear()
-        stdscr.addstr(0, 0, "Select a project:")
-        for i, project in enumerate(project_list):
-            if i == selected_index:
-                stdscr.addstr(i+2, 0, "> {}".format(project))
-            else:
-                stdscr.addstr(i+2, 0, "  {}".format(project))
-        stdscr.refresh()
         c = stdscr.getch()
+        previous_index = selected_index
+        previous_query = query
         if c == curses.KEY_UP:
             selected_index = max(0, selected_index-1)
         elif c == curses.KEY_DOWN:
-            selected_index = min(len(project_list)-1, selected_index+1)
+            selected_index = min(len(choices)-1, selected_index+1)
         elif c == ord('\n'):
-            if selected_index == len(project_list) - 1:  # "Enter a new project" is selected
+            if selected_index == len(choices) - 1:  # "Enter a new project" is selected
                 return None
             else:
-                return project_list[selected_index]
-
-def input_project(stdscr):
-    stdscr.addstr(1, 0, "Enter a project:")
+                return choices[selected_index]
+        elif c == curses.KEY_BACKSPACE or c == 127:
+            query = query[:-1]
+        elif 32 <= c < 256:
+            query += chr(c)
+        if query != previous_query:
+            previous_count = len(choices)
+            matches = get_search("timesheet.csv").projects.search(query, max_rows-1) if query else project_list[:max_rows-1]
+            choices = matches + ["Enter a new project"]
+            selected_index = 0
+            for i in range(max(len(choices), previous_count)):
+                draw_project(i)
+        elif selected_index != previous_index:
+            # only the rows that lost and gained the marker change
+            draw_project(previous_index)
+            draw_project(selected_index)
+        draw_query()
+        stdscr.noutrefresh()
+        curses.doupdate()
+
+def input_line(stdscr, row, prompt):
+    """Read a line of text, redrawing only the prompt row as it is typed"""
+    stdscr.clear()
+    stdscr.addstr(row, 0, prompt)
     stdscr.refresh()
-    project = ""
+    text = ""
     while True:
         c = stdscr.getch()
-        if c == ord('\n'):
+        if c == curses.KEY_ENTER or c == 10 or c == 13:
             break
         elif c == curses.KEY_BACKSPACE or c == 127:
-            project = project[:-1]
+            text = text[:-1]
         elif c != -1:  # Ignore timeout (-1)
-            project += chr(c)
-        stdscr.clear()
-        stdscr.addstr(1, 0, "Enter a project: {}".format(project))
-        stdscr.refresh()
-    return project
+            text += chr(c)
+        else:
+            continue
+        stdscr.move(row, 0)
+        stdscr.clrtoeol()
+        stdscr.addstr(row, 0, "{} {}".format(prompt, text))
+        stdscr.noutrefresh()
+        curses.doupdate()
+    return text
 
-def select_description(stdscr, records):
-    """Select a description from the last 3 tasks or enter a new one"""
+def input_project(stdscr):
+    return input_line(stdscr, 1, "Enter a project:")
+
+def matching_records(query, n=10):
+    """The last entry of each description matching query, best match first, or the
+    n most recent descriptions while nothing has been typed"""
+    if not query:
+        return last_descriptions_from_csv(n)
+    index = get_index("timesheet.csv")
+    return [index.entries[index.by_description[description][-1]]
+            for description in get_search("timesheet.csv").descriptions.search(query, n)]
+
+def select_description(stdscr, limit=10):
+    """Select one of the descriptions matching what has been typed so far, or enter a new one"""
     selected_index = -1
     custom_description = ""
+    records = matching_records(custom_description, limit)
 
     # define the headers
     headers = ["Date", "Duration", "Description", "Project"]
 
-    while True:
-        stdscr.erase()
-        stdscr.addstr(0, 0, "Select a description or enter a new one:")
-
-        # draw the table headers
-        for i, header in enumerate(headers):
-            stdscr.addstr(2, i*25, header)
-
-        for i, record in enumerate(records):
-            date, duration, desc, project = record
-
-            # Highlight selected row
-            if i == selected_index:
-                stdscr.attron(curses.A_REVERSE)
-
-            stdscr.addstr(i+3, 0, f"{date:20}")
-            stdscr.addstr(i+3, 25, f"{duration:20}")
-            stdscr.addstr(i+3, 50, f"{desc[:20]:20}")
-            stdscr.addstr(i+3, 75, f"{project[:20]:20}")
-
-            if i == selected_index:
-                stdscr.attroff(curses.A_REVERSE)
-
-        stdscr.addstr(len(records)+3, 0, "Custom: {}".format(custom_description))
-        stdscr.refresh()
+    def draw_record(i):
+        stdscr.move(i+3, 0)
+        stdscr.clrtoeol()
+        if i >= len(records):
+            return
+        entry = records[i]
+        # Highlight selected row
+        attr = curses.A_REVERSE if i == selected_index else curses.A_NORMAL
+        stdscr.addstr(i+3, 0, f"{entry.start_text:20}", attr)
+        stdscr.addstr(i+3, 25, f"{entry.duration_text:20}", attr)
+        stdscr.addstr(i+3, 50, f"{entry.description[:20]:20}", attr)
+        stdscr.addstr(i+3, 75, f"{entry.project[:20]:20}", attr)
+
+    def draw_custom():
+        stdscr.move(1, 0)
+        stdscr.clrtoeol()
+        stdscr.addstr(1, 0, "Description: {}".format(custom_description))
+
+    stdscr.erase()
+    stdscr.addstr(0, 0, "Select a description or type to search and enter a new one:")
+
+    # draw the table headers
+    for i, header in enumerate(headers):
+        stdscr.addstr(2, i*25, header)
+    for i in range(len(records)):
+        draw_record(i)
+    draw_custom()
+    stdscr.refresh()
 
+    while True:
         c = stdscr.getch()
+        previous_index = selected_index
+        previous_description = custom_description
+        # both keys keep selected_index at -1 (the typed description) while nothing matches
         if c == curses.KEY_UP:
-            selected_index = max(0, selected_index - 1)
+            selected_index = min(len(records) - 1, max(0, selected_index - 1))
         elif c == curses.KEY_DOWN:
             selected_index = min(len(records) - 1, selected_index + 1)
         elif c == ord('\n'):
-            return records[selected_index][2] if selected_index >= 0 else custom_description
+            return records[selected_index].description if 0 <= selected_index < len(records) else custom_description
         elif c == curses.KEY_BACKSPACE or c == 127:
             custom_description = custom_description[:-1]
-        elif c != -1:  # Ignore timeout (-1)
+        elif 32 <= c < 256:
             custom_description += chr(c)
-
-
-def main(stdscr):
-    """Main function"""
-     # Read properties from the timer.properties file
-    properties = parse_properties("timer.properties")
-
-    # Perform a git pull to ensure the latest version of the code
-    if check_git_pull():
-        stdscr.clear()
-        stdscr.addstr(0, 0, "A new version of the script has been downloaded.")
-        stdscr.addstr(1, 0, "Please restart the script.")
-        stdscr.refresh()
-        while True:
-            c = stdscr.getch()
-            if c == ord('q'):
-                return
-
-    # Download timesheet.csv from the remote system
-    download_timesheet(properties)
-
-
-    global start_time
-    curses.curs_set(1)
-    curses.init_pair(1, curses.COLOR_WHITE, curses.COLOR_BLACK)
-    curses.init_pair(2, curses.COLOR_BLACK, curses.COLOR_WHITE)
-    stdscr.bkgd(curses.color_pair(2))
-#    stdscr.timeout(1000)  # Set timeout to 1000 ms (1 second)
-
-# Display all entries from the timesheet.csv
+        if custom_description != previous_description:
+            # show the entries matching what has been typed so far
+            previous_count = len(records)
+            records = matching_records(custom_description, limit)
+            selected_index = -1
+            for i in range(max(len(records), previous_count)):
+                draw_record(i)
+        elif selected_index != previous_index:
+            # only the rows that lost and gained the highlight change
+            if previous_index >= 0:
+                draw_record(previous_index)
+            if selected_index >= 0:
+                draw_record(selected_index)
+        draw_custom()
+        stdscr.noutrefresh()
+        curses.doupdate()
+
+
+def draw_timers(stdscr, screen, timer_manager):
+    """One row per timer with its number, elapsed time, state, description and project"""
+    width = stdscr.getmaxyx()[1] - 1
+    draw_line(stdscr, screen, 0, "1-9: pause/resume a timer  n: new timer  p: stop and save all  q: quit without saving"[:width])
+    for i, (name, stopwatch) in enumerate(timer_manager.timers.items()):
+        text = "{}. {} {:7} {} [{}]".format(i + 1, format_time(stopwatch.elapsed()),
+                                           "" if stopwatch.running else "paused", name, stopwatch.project)
+        draw_line(stdscr, screen, i + 2, text[:width], curses.color_pair(1) if stopwatch.running else 0)
+    return len(timer_manager) + 3
+
+def new_timer(stdscr):
+    """Select the description and project of a new timer and wait for it to be started"""
+    # Display all entries from the timesheet.csv
+    stdscr.clear()
     display_timesheet(stdscr)
 
     # Select or enter a description
-    last_descriptions = last_descriptions_from_csv(10)
-    if last_descriptions:
+    if last_descriptions_from_csv(1):
         stdscr.addstr(0, 0, "Select a description:")
         stdscr.refresh()
-        description = select_description(stdscr, last_descriptions)
+        description = select_description(stdscr)
         if description:
             # Extract the actual description from the selected option
             description = description.split(" - ", 2)[-1]
     else:
-        stdscr.addstr(0, 0, "Enter a description:")
-        stdscr.refresh()
-        description = ""
-        while True:
-            c = stdscr.getch()
-            if c == curses.KEY_ENTER or c == 10 or c == 13:
-                break
-            elif c == curses.KEY_BACKSPACE:
-                description = description[:-1]
-            else:
-                description += chr(c)
-            stdscr.erase()  # Use erase instead of clear
-            stdscr.addstr(0, 0, "Enter a description: {}".format(description))
-            stdscr.refresh()
+        description = input_line(stdscr, 0, "Enter a description:")
 
 
     # Select or enter a project
@@ -259,46 +310,100 @@ def main(stdscr):
     stdscr.clear()
     stdscr.addstr(0, 0, "Press 's' to start the timer...")
     stdscr.refresh()
-    stdscr.timeout(500) # Set timeout to 1000 ms (1 second)
+    stdscr.timeout(-1)  # Nothing to update until a key is pressed
     
-    while True:
-        c = stdscr.getch()
-        if c == ord('s'):
-            stdscr.clear()
-            start_time = time.time()
-            start_time_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time))
-            stdscr.addstr(0, 0, "Timer started at {}".format(start_time_str))
-            stdscr.addstr(1, 0, "Description: {}".format(description))
-            stdscr.addstr(2, 0, "Project: {}".format(project))
-            elapsed_time = time.time() - start_time
-            stdscr.addstr(3, 0, "Elapsed time: {}".format(format_time(elapsed_time)), curses.color_pair(1))
-            stdscr.refresh()
-            break
+    while stdscr.getch() != ord('s'):
+        pass
+    return Stopwatch(description, project)
+
+
+def main(stdscr, properties):
+    """Main function, properties come from timer.properties and the command line (see config.py)"""
+    configure_metrics(properties)
+    global storage_backend
+    storage_backend = properties.get('storage', 'csv')
+
+    # Check for a new version of the code in the background, at most once per update_check_interval
+    update_checker = UpdateChecker(properties)
+    update_checker.start()
 
-    # Monitor and display the elapsed time
+    # Download timesheet.csv from the remote system in the background, the selection
+    # below works from the local copy in the meantime
+    sync_worker = SyncWorker(properties, "timesheet.csv")
+    sync_worker.download()
+    # Upload entries that an earlier session could not
+    sync_worker.flush()
+
+    curses.curs_set(1)
+    curses.init_pair(1, curses.COLOR_WHITE, curses.COLOR_BLACK)
+    curses.init_pair(2, curses.COLOR_BLACK, curses.COLOR_WHITE)
+    stdscr.bkgd(curses.color_pair(2))
+#    stdscr.timeout(1000)  # Set timeout to 1000 ms (1 second)
+
+    # Offer to carry on with timers that a crashed or killed session left behind
+    timer_manager = TimerManager("timesheet.csv")
+    recovered = timer_manager.checkpoint.load()
+    if recovered and offer_recovery(stdscr, recovered):
+        for stopwatch, state in recovered:
+            timer_manager.restore(stopwatch, state)
+    else:
+        timer_manager.checkpoint.clear()
+        timer_manager.start(timer_manager.add(new_timer(stdscr)))
+    stdscr.clear()
+
+    # Monitor and display the timers. getch sleeps until the next running timer reaches its
+    # next whole second or a key is pressed, and only rows whose text changed are redrawn.
+    screen = {}
     while True:
+        timer_manager.checkpoint_if_due()
+        status_row = draw_timers(stdscr, screen, timer_manager)
+        draw_line(stdscr, screen, status_row, sync_status_text(sync_worker))
+        draw_line(stdscr, screen, status_row + 1, update_notice_text(update_checker))
+        stdscr.noutrefresh()
+        curses.doupdate()
+        tick = timer_manager.next_tick()
+        # rounded up and past the boundary, so the timer has reached the next second when getch returns
+        stdscr.timeout(1000 if tick is None else math.ceil(tick * 1000) + 1)
         c = stdscr.getch()
-        if c == ord('q'):
+        if c == ord('n'):
+            timer_manager.start(timer_manager.add(new_timer(stdscr)))
+            stdscr.clear()
+            screen.clear()
+        elif ord('1') <= c <= ord('9') and c - ord('1') < len(timer_manager):
+            timer_manager.toggle(list(timer_manager.timers)[c - ord('1')])
+        elif c == ord('q'):
+            timer_manager.checkpoint.clear()
+            wait_for_sync(stdscr, sync_worker, status_row)
             break
         elif c == ord('p'):
-            stdscr.addstr(0, 0, "Timer stopped at {}".format(time.strftime("%Y-%m-%d %H:%M:%S")))
+            entries = timer_manager.stop(list(timer_manager.timers))
+            draw_line(stdscr, screen, 0, "Timers stopped at {}".format(time.strftime("%Y-%m-%d %H:%M:%S")))
             stdscr.refresh()
-            elapsed_time = time.time() - start_time
-            
-            # Download again in case another system has updated this file since we last checked
-            download_timesheet(properties)
-            
-            save_time(description, project, elapsed_time)
             
-            # Upload timesheet.csv to the remote system
-            upload_timesheet(properties)
+            # Download again in case another system has updated this file since we last checked,
+            # then save every entry and upload timesheet.csv to the remote system once
+            save_time(sync_worker, entries)
+            timer_manager.save_checkpoint()
+            wait_for_sync(stdscr, sync_worker, status_row)
             
             break
-        current_time = time.time()
-        elapsed_time = current_time - start_time
-        stdscr.addstr(3, 0, "Elapsed time: {}".format(format_time(elapsed_time)), curses.color_pair(1))
-        stdscr.refresh()
-        time.sleep(1)
 
-# Start curses
-curses.wrapper(main)
+if __name__ == "__main__":
+    if sys.argv[1:2] in (["report"], ["export"]):
+        # Headless report or export, e.g. timer.py report -by week -project foo
+        from cli import COMMANDS
+        try:
+            COMMANDS[sys.argv[1]](sys.argv[2:])
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # the reader went away (e.g. piped into head), nothing left to report
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    else:
+        parser = argparse.ArgumentParser(description='Track time in the terminal, or use the report and export commands')
+        parser.add_argument('-profile', dest='profile', type=str, default=None, help='write a cProfile of the session to this file')
+        add_property_flags(parser)
+        args = parser.parse_args()
+        if args.profile:
+            start_profile(args.profile)
+        # Start curses
+        curses.wrapper(main, load_properties(".", args))
@@ -0,0 +1,510 @@
+import csv
+import io
+import os
+import mmap
+import hashlib
+import functools
+import threading
+import contextlib
+import itertools
+from array import array
+from datetime import date
+
+from metrics import phase
+
+TIMESHEET_FILE = "timesheet.csv"
+EPOCH = date(1970, 1, 1).toordinal()
+DAY = 86400  # seconds
+
+
+def parse_duration(duration):
+    """Convert an HH:MM:SS duration string to a number of seconds"""
+    try:
+        hours, minutes, seconds = duration.split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except ValueError:
+        return 0
+
+
+# Starts and durations repeat a lot (every entry of a day shares its date), so their
+# conversions are cached
+@functools.lru_cache(maxsize=1 << 16)
+def format_duration(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return "{:02d}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def canonical_seconds(duration):
+    """The seconds of an HH:MM:SS duration written the way the timer writes it, None for
+    any other text"""
+    seconds = parse_duration(duration)
+    return seconds if format_duration(seconds) == duration else None
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def parse_day(day):
+    """The day number (days since the epoch) of a YYYY-MM-DD date, None for any other text"""
+    try:
+        parsed = date.fromisoformat(day)
+    except ValueError:
+        return None
+    return parsed.toordinal() - EPOCH if parsed.isoformat() == day else None
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def format_day(day):
+    return date.fromordinal(day + EPOCH).isoformat()
+
+
+def parse_start(start):
+    """Convert a YYYY-MM-DD HH:MM:SS start time to seconds since the epoch, counted in
+    the wall-clock time the timesheet is written in; None for any other text"""
+    if len(start) != 19 or start[10] != " ":
+        return None
+    day, clock = parse_day(start[:10]), canonical_seconds(start[11:])
+    if day is None or clock is None or clock >= DAY:
+        return None
+    return day * DAY + clock
+
+
+def format_start(seconds):
+    day, clock = divmod(seconds, DAY)
+    return f"{format_day(day)} {format_duration(clock)}"
+
+
+class Entry:
+    """One timesheet entry: the start and duration as integer seconds (the start since
+    the epoch, in the timesheet's wall-clock time), the description and the project.
+
+    Rows that are not in the form the timer writes (a start without the time, a
+    duration like 1:30) also keep their original start and duration text in text, so
+    row() always gives back exactly what was read and entry ids never change.
+    """
+    __slots__ = ("start", "seconds", "description", "project", "text")
+
+    def __init__(self, start, seconds, description, project, text=None):
+        self.start = start
+        self.seconds = seconds
+        self.description = description
+        self.project = project
+        self.text = text  # None, or (start, duration) as read
+
+    @classmethod
+    def from_row(cls, row, strings=None):
+        """The entry of a [start, duration, description, project] row. Descriptions and
+        projects are interned in strings, a dict, when one is given."""
+        start_text, duration_text, description, project = row[:4]
+        if strings is not None:
+            description = strings.setdefault(description, description)
+            project = strings.setdefault(project, project)
+        start, seconds = parse_start(start_text), canonical_seconds(duration_text)
+        if start is None or seconds is None:
+            return cls(start or 0, parse_duration(duration_text), description, project, (start_text, duration_text))
+        return cls(start, seconds, description, project)
+
+    def __reduce__(self):
+        # pickled as a constructor call, far smaller than the default for slotted objects
+        return Entry, (self.start, self.seconds, self.description, self.project, self.text)
+
+    def __repr__(self):
+        return f"Entry({self.row()!r})"
+
+    @property
+    def start_text(self):
+        return self.text[0] if self.text else format_start(self.start)
+
+    @property
+    def duration_text(self):
+        return self.text[1] if self.text else format_duration(self.seconds)
+
+    @property
+    def day(self):
+        return self.text[0][:10] if self.text else format_day(self.start // DAY)
+
+    @property
+    def month(self):
+        return self.day[:7]
+
+    @property
+    def id(self):
+        return entry_id(self.row())
+
+    def row(self):
+        """The [start, duration, description, project] row of the timesheet"""
+        return [self.start_text, self.duration_text, self.description, self.project]
+
+
+class Entries:
+    """Timesheet entries stored column-wise.
+
+    Starts and durations are integer seconds in arrays, and descriptions and projects
+    ids into one table of their distinct strings, so an entry takes four machine words
+    rather than a list of four strings. Indexing and iterating build Entry objects on
+    access.
+    """
+
+    def __init__(self):
+        self.start = array('q')
+        self.seconds = array('q')
+        self.description = array('q')
+        self.project = array('q')
+        self.strings = []  # id -> description or project
+        self.ids = {}  # description or project -> id
+        self.texts = {}  # position -> Entry.text, for the entries that have one
+
+    def __len__(self):
+        return len(self.start)
+
+    def intern(self, text):
+        """The id of a description or project, adding it to the table if it is new"""
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+    def append(self, entry):
+        if entry.text is not None:
+            self.texts[len(self.start)] = entry.text
+        self.start.append(entry.start)
+        self.seconds.append(entry.seconds)
+        ids = self.ids
+        description, project = ids.get(entry.description), ids.get(entry.project)
+        self.description.append(self.intern(entry.description) if description is None else description)
+        self.project.append(self.intern(entry.project) if project is None else project)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                return list(self.iter_from(start, stop))
+            return [self[j] for j in range(start, stop, step)]
+        if i < 0:
+            i += len(self)
+        strings = self.strings
+        return Entry(self.start[i], self.seconds[i], strings[self.description[i]], strings[self.project[i]],
+                     self.texts.get(i))
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, first, stop=None):
+        """Yield the entries from position first on, up to stop"""
+        strings, texts = self.strings, self.texts
+        columns = (self.start, self.seconds, self.description, self.project)
+        for i, start, seconds, description, project in zip(range(first, len(self) if stop is None else stop),
+                                                             *(itertools.islice(column, first, stop) for column in columns)):
+            yield Entry(start, seconds, strings[description], strings[project], texts.get(i))
+
+
+def entry_id(row):
+    """Stable identifier of a timesheet entry, derived from its four columns so the
+    same entry gets the same id on every machine"""
+    return hashlib.sha1("\x1f".join(row[:4]).encode("utf-8")).hexdigest()[:16]
+
+
+FSYNC_POLICIES = ("always", "rewrites", "never")
+
+
+def fsync_directory(path):
+    """Make a rename into the directory of path survive a power cut. Directories
+    cannot be opened on Windows, where renames need no such step."""
+    try:
+        fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class TimesheetWriter:
+    """Every write to a timesheet file goes through here.
+
+    Entries are appended in batches, each with a single buffered write. Whole-file
+    rewrites (downloads, merges, exports) go to a temporary file next to the timesheet
+    that is renamed over it once complete, so readers and crashes only ever see the
+    old or the new content, never a half-written file.
+
+    The fsync policy decides what is flushed to the disk before a write returns:
+    "always" (the default) syncs appends and rewrites, "rewrites" only rewrites, whose
+    rename must not overtake their data, and "never" leaves everything to the OS.
+    Saved entries are fsync'd in the journal before they are appended in any case.
+    """
+
+    def __init__(self, path, fsync="always"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy {fsync}, expected one of {', '.join(FSYNC_POLICIES)}")
+        self.path = path
+        self.fsync = fsync
+
+    def append(self, entries):
+        """Append a batch of entries with one write"""
+        out = io.StringIO()
+        csv.writer(out).writerows(entry.row() for entry in entries)
+        self.append_bytes(out.getvalue().encode("utf-8"))
+
+    def append_bytes(self, data):
+        with open(self.path, "ab") as f:
+            f.write(data)
+            if self.fsync == "always":
+                f.flush()
+                os.fsync(f.fileno())
+
+    @contextlib.contextmanager
+    def rewrite(self):
+        """Give a temporary path to write the new content of the file to. It replaces the
+        file once the with block succeeds and is removed if the block fails."""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            yield tmp_path
+            if self.fsync != "never":
+                with open(tmp_path, "ab") as f:
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            if self.fsync != "never":
+                fsync_directory(self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def replace(self, data):
+        """Atomically replace the content of the file with data"""
+        with self.rewrite() as tmp_path:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+
+
+def reversed_lines(path):
+    """Yield the lines of a file last first, without their line ending.
+
+    The file is memory-mapped and scanned backwards from the end, so only the lines
+    that are consumed are ever read or copied, whatever the size of the file.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # an empty file cannot be mapped
+            return
+        with mapped:
+            end = len(mapped)
+            if mapped[end - 1:end] == b"\n":
+                end -= 1
+            while end > 0:
+                start = mapped.rfind(b"\n", 0, end) + 1
+                yield mapped[start:end]
+                end = start - 1
+
+
+def reversed_rows(path):
+    """Yield the rows of the timesheet last first, parsing only the rows consumed"""
+    pending = b""
+    for line in reversed_lines(path):
+        record = line + b"\n" + pending if pending else line
+        if record.count(b'"') % 2:
+            # part of a quoted field spanning several lines, read on until the record is whole
+            pending = record
+            continue
+        pending = b""
+        for row in csv.reader(io.StringIO(record.decode("utf-8", errors="replace"), newline="")):
+            if len(row) >= 4:
+                yield row[:4]
+
+
+def tail_entries(path, n):
+    """The last n entries of the timesheet, oldest first"""
+    entries = [Entry.from_row(row) for row in itertools.islice(reversed_rows(path), max(n, 0))]
+    entries.reverse()
+    return entries
+
+
+def recent_descriptions(path, n):
+    """The last entry of each of the n most recently used descriptions, most recent first"""
+    seen, entries = set(), []
+    for row in reversed_rows(path):
+        if len(entries) >= n:
+            break
+        if row[2] not in seen:
+            seen.add(row[2])
+            entries.append(Entry.from_row(row))
+    return entries
+
+
+class TailReader:
+    """Reads an append-only CSV file incrementally.
+
+    The reader remembers how many bytes it has consumed and a checksum of the last
+    line it read. On the next read only the bytes appended after that offset are
+    parsed, provided the last line is still in place; otherwise the file is assumed
+    to have been replaced (e.g. by a download) and is read again from the start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self._last_line = None  # (start offset, length, sha1 digest)
+        self._complete = True  # False if the file did not end with a newline
+
+    def get_state(self):
+        """The position of the reader, so another process can carry on with set_state()"""
+        last_line = None
+        if self._last_line:
+            start, length, digest = self._last_line
+            last_line = [start, length, digest.hex()]
+        return {'offset': self.offset, 'last_line': last_line, 'complete': self._complete}
+
+    def set_state(self, state):
+        self.offset = state['offset']
+        last_line = state['last_line']
+        self._last_line = (last_line[0], last_line[1], bytes.fromhex(last_line[2])) if last_line else None
+        self._complete = state['complete']
+
+    def _prefix_unchanged(self, f, size):
+        if self.offset == 0:
+            return True
+        if size < self.offset or not self._complete:
+            return False
+        start, length, digest = self._last_line
+        f.seek(start)
+        return hashlib.sha1(f.read(length)).digest() == digest
+
+    def read(self):
+        """Return (rows, full) where rows are the newly read rows and full is True
+        if the file was read from the start"""
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            full = not self._prefix_unchanged(f, size)
+            if full:
+                self.reset()
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        if not data:
+            return [], full
+        end = len(data) - 1 if data.endswith(b"\n") else len(data)
+        line_start = data.rfind(b"\n", 0, end) + 1
+        self._last_line = (self.offset + line_start, len(data) - line_start,
+                           hashlib.sha1(data[line_start:]).digest())
+        self._complete = data.endswith(b"\n")
+        self.offset += len(data)
+        rows = list(csv.reader(io.StringIO(data.decode("utf-8", errors="replace"), newline="")))
+        return rows, full
+
+
+class TimesheetIndex:
+    """In-memory index over timesheet.csv.
+
+    The file is parsed in a single pass into Entries, and their positions are indexed
+    by month, project and description. Descriptions and projects are kept in recency
+    order (most recently used last). The file is only looked at again when its size or
+    mtime changes, and then only the rows appended since the last refresh are parsed.
+
+    The index is shared by the UI thread and the sync worker, so refreshes and
+    membership checks hold a lock; a refresh never runs half way through another.
+    """
+
+    def __init__(self, path=TIMESHEET_FILE):
+        self.path = path
+        self._stat = None
+        self._reader = TailReader(path)
+        self.lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.entries = Entries()
+        self.by_month = {}  # "YYYY-MM" -> array of entry positions
+        self.by_project = {}  # project -> array of entry positions, in recency order
+        self.by_description = {}  # description -> array of entry positions, in recency order
+
+    def refresh(self):
+        """Re-read the timesheet if it changed on disk since the last refresh"""
+        with self.lock:
+            return self._refresh()
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._stat is not None:
+                self._clear()
+                self._reader.reset()
+                self._stat = None
+            return self
+        stat_key = (st.st_size, st.st_mtime_ns)
+        if stat_key == self._stat:
+            return self
+        with phase("parse", path=self.path) as fields:
+            offset = self._reader.offset
+            rows, full = self._reader.read()
+            if full:
+                self._clear()
+            for row in rows:
+                self._add_row(row)
+            fields.update(rows=len(rows), bytes=self._reader.offset - (0 if full else offset), full=full)
+        self._stat = stat_key
+        return self
+
+    def _add_row(self, row):
+        if len(row) < 4:
+            return
+        i = len(self.entries)
+        self.entries.append(Entry.from_row(row))
+        self.by_month.setdefault(row[0][:7], array('q')).append(i)
+        # pop and re-insert so that dict order reflects the last time a key was used
+        for key, index in ((row[3], self.by_project), (row[2], self.by_description)):
+            indices = index.pop(key, None) or array('q')
+            indices.append(i)
+            index[key] = indices
+
+    def __contains__(self, entry):
+        """Whether the timesheet has an entry with the same four columns as entry"""
+        with self.lock:
+            row, starts = entry.row(), self.entries.start
+            return any(starts[i] == entry.start and self.entries[i].row() == row
+                       for i in self.by_description.get(entry.description, ()))
+
+    def last(self, n):
+        """Return the last n entries of the timesheet"""
+        return self.entries[-n:] if n > 0 else []
+
+    def last_entry(self):
+        return self.entries[-1] if len(self.entries) else None
+
+    def projects(self):
+        """Sorted list of all projects"""
+        return sorted(self.by_project)
+
+    def descriptions(self):
+        """All descriptions, most recently used first"""
+        return list(reversed(self.by_description))
+
+    def months(self):
+        """Month keys ("YYYY-MM") in the order they first appear in the file"""
+        return list(self.by_month)
+
+    def month_entries(self, month):
+        return [self.entries[i] for i in self.by_month.get(month, ())]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(path=TIMESHEET_FILE):
+    """Return the shared, refreshed index for the timesheet at path"""
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = TimesheetIndex(path)
+    return index.refresh()
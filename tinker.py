@@ -1,17 +1,22 @@
 from datetime import datetime, timedelta
-import sys
 import os
 import time
-import csv
-import subprocess
 import logging
-from tkinter import Tk, Label, Button, Entry, Listbox, StringVar, Toplevel, Text, BOTH, YES, NONE, DISABLED, Scrollbar, RIGHT, Frame, Canvas, Y
+import itertools
+from tkinter import Tk, Label, Button, StringVar, Toplevel, Scrollbar, Frame, EventType
 import argparse
 
-from tkinter import ttk
+from tkinter import ttk, messagebox
 from tkinter.ttk import Combobox
 from datetime import datetime
-from collections import defaultdict
+
+from config import add_property_flags, load_properties
+from metrics import configure_metrics, start_profile
+from search import get_search
+from stopwatch import CHECKPOINT_INTERVAL, Stopwatch, TimerManager
+from storage import get_store
+from sync import SyncWorker
+from updates import UpdateChecker
 
 def format_timedelta(td):
     total_seconds = int(td.total_seconds())
@@ -20,77 +25,119 @@ def format_timedelta(td):
     return f"{hours} hours {minutes} minutes {seconds} seconds"
 
 
-def check_git_pull():
-    """Performs a git pull and checks if any changes were made."""
-    result = subprocess.run(["git", "pull"], capture_output=True, text=True)
-    logging.info(f"git check results: {result}")
-    return "Already up to date." not in result.stdout
-
-def save_time(description, project, elapsed_time_seconds,start_time_str):
-        """Save elapsed time to CSV file"""
-        elapsed_time_hours = int(elapsed_time_seconds / 3600)
-        elapsed_time_minutes = int((elapsed_time_seconds % 3600) / 60)
-        elapsed_time_seconds = int(elapsed_time_seconds % 60)
-        elapsed_time_str = "{:02d}:{:02d}:{:02d}".format(elapsed_time_hours, elapsed_time_minutes, elapsed_time_seconds)
-        
-        with open(properties['timesheet_path'], "a", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow([start_time_str, elapsed_time_str, description, project])
-
-def download_timesheet(properties):
-    if not properties['remote_save'] == "true":
-        return
-    """Downloads timesheet.csv from the remote system using SCP."""
-    remote_path = f"{properties['host']}:{properties['path']}/timesheet.csv"
-    subprocess.run(["scp", remote_path, properties['timesheet_path']])
-    logging.info(f"Downloading latest version of timesheet...scp {remote_path} {properties['timesheet_path']}")
-
-
-
-def upload_timesheet(properties):
-    if not properties['remote_save'] == "true":
-        return
-    """Uploads timesheet.csv to the remote system using SCP."""
-    logging.info(f"Uploading latest version of timesheet...")
-    remote_path = f"{properties['host']}:{properties['path']}/timesheet.csv"
-    subprocess.run(["scp", properties['timesheet_path'], remote_path])
-    
-def parse_properties(filename):
-    properties = {}
-    with open(filename, "r") as f:
-        for line in f:
-            key, value = line.strip().split("=", 1)
-            properties[key] = value
-    return properties
+def save_time(sync_worker, entries):
+        """Save the entries to the journal, the sync worker then adds them to the CSV file and uploads them together"""
+        sync_worker.save(*entries)
 
 # Set up logging
 
 
-class TimesheetApp:
+# Number of descriptions or projects offered in the comboboxes
+CHOICES = 50
+
+
+class SummaryTable:
+    """Treeview showing the summary rows.
+
+    Rows are timesheet entries, shown as their day, description and duration, or
+    (tag, values) tuples for headings and totals. They are taken from an iterable
+    lazily: only the first chunk is inserted up front and more are appended as the
+    user scrolls towards the end of what has been inserted so far.
+    """
+    CHUNK_SIZE = 200
+    bg_color1 = "#703224"  # A light gray color
+
     def __init__(self, master):
+        self.rows = iter(())
+        self.more = False  # whether rows may have more rows to insert
+
+        self.scrollbar = Scrollbar(master, orient="vertical")
+        self.tree = ttk.Treeview(master, columns=("date", "description", "duration"), show="headings", yscrollcommand=self.on_scroll)
+        self.scrollbar.config(command=self.tree.yview)
+        self.tree.heading("date", text="Date")
+        self.tree.heading("description", text="Description")
+        self.tree.heading("duration", text="Duration")
+        self.tree.column("date", width=120, anchor='w')
+        self.tree.column("description", width=500, anchor='w')
+        self.tree.column("duration", width=180, anchor='center')
+        self.tree.tag_configure("month", background=self.bg_color1)
+        self.tree.tag_configure("total", background=self.bg_color1)
+
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+
+    def set_rows(self, rows):
+        self.tree.delete(*self.tree.get_children())
+        self.rows = iter(rows)
+        self.more = True
+        self.insert_more()
+        self.tree.yview_moveto(0)
+
+    def insert_more(self):
+        inserted = 0
+        for row in itertools.islice(self.rows, self.CHUNK_SIZE):
+            if isinstance(row, tuple):
+                tag, values = row
+                self.tree.insert("", "end", values=values, tags=(tag,) if tag else ())
+            else:
+                self.tree.insert("", "end", values=(row.day, row.description, timedelta(seconds=row.seconds)))
+            inserted += 1
+        self.more = inserted == self.CHUNK_SIZE
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        # Fill in the next chunk once the view gets close to the last inserted row
+        if float(last) > 0.9 and self.more:
+            self.insert_more()
+
+
+class TimesheetApp:
+    def __init__(self, master, sync_worker, update_checker):
         self.master = master
         self.master.title("Timesheet App")
+        self.sync_worker = sync_worker
+        self.update_checker = update_checker
+        self.sync_poll_id = None
         
-        self.start_time = None
+        self.timer_manager = TimerManager(properties['timesheet_path'])
+        self.clock_after_id = None
+        self.checkpoint_after_id = None
         self.project_var = StringVar()
-        self.already_started = False
-        self.paused = False 
-        # Initialize labels for description and project titles
-        self.description_label = Label(master, text="")
-        self.project_label = Label(master, text="")
-        self.timer_label = Label(master, text="", font=("Helvetica", 35))
+        # Initialize labels for description and project titles, they show the selected timer
+        self.timer_frame = Frame(master)
+        self.description_label = Label(self.timer_frame, text="")
+        self.project_label = Label(self.timer_frame, text="")
+        self.timer_label = Label(self.timer_frame, text="", font=("Helvetica", 35))
+        self.project_label.pack()
+        self.description_label.pack()
+        self.timer_label.pack()
+
+        # Every timer of this session, several can be selected to pause, resume or save them together
+        self.timer_list = ttk.Treeview(self.timer_frame, columns=("name", "project", "elapsed", "state"), show="headings", height=4)
+        for column, heading, width in (("name", "Description", 220), ("project", "Project", 120), ("elapsed", "Elapsed", 80), ("state", "", 70)):
+            self.timer_list.heading(column, text=heading)
+            self.timer_list.column(column, width=width, anchor='w')
+        self.timer_list.bind("<<TreeviewSelect>>", lambda event: self.update_clock())
+        self.timer_list.pack()
+        self.pause_button = Button(self.timer_frame, text="Pause/Resume", command=self.toggle_timers)
+        self.save_button = Button(self.timer_frame, text="Stop and Save", command=self.save_entries)
+        self.pause_button.pack(side="left")
+        self.save_button.pack(side="right")
         
         # Get unique descriptions and projects and the last description and project from timesheet.csv
-        self.unique_descriptions, self.unique_projects, last_description, last_project = self.get_unique_data()
+        self.unique_projects, last_description, last_project = self.get_unique_data()
         
-        self.description_combobox = Combobox(master, values=self.unique_descriptions)
+        # The choices are the best matches for what has been typed so far, see filter_choices
+        self.description_combobox = Combobox(master, values=self.search_choices("descriptions", ""))
+        self.description_combobox.bind("<KeyRelease>", lambda event: self.filter_choices(event, self.description_combobox, "descriptions"))
         self.description_combobox.pack()
         if last_description:
             self.description_combobox.set(last_description)
         else:
             self.description_combobox.set("Select or type a description")
         
-        self.project_combobox = Combobox(master, values=self.unique_projects)
+        self.project_combobox = Combobox(master, values=self.search_choices("projects", ""))
+        self.project_combobox.bind("<KeyRelease>", lambda event: self.filter_choices(event, self.project_combobox, "projects"))
         self.project_combobox.pack()
         if last_project:
             self.project_combobox.set(last_project)
@@ -98,92 +145,123 @@ class TimesheetApp:
             self.project_combobox.set("Select or type a project")
         
         self.start_button = Button(master, text="Start Timer", command=self.start_timer)
-        self.stop_button = Button(master, text="Stop Timer", command=self.stop_timer)
-        self.save_button = Button(master, text="Save Entry", command=self.save_entry)
         self.start_button.pack()
         
         self.details_button = Button(master, text="Summary", command=self.show_details_window)
         self.details_button.pack()
-        # Add a button to resume the timer
-        self.resume_button = Button(master, text="Resume Timer", command=self.resume_timer)
+
+        # Shows what the background sync is doing
+        self.status_label = Label(master, text="", fg="gray")
+        self.status_label.pack(side="bottom")
+        self.update_label = Label(master, text="", fg="red")
         
+        self.master.bind("<Unmap>", self.on_window_state)
+        self.master.bind("<Map>", self.on_window_state)
         self.update_clock()
+        self.poll_sync()
+        self.poll_updates()
+        self.master.after_idle(self.offer_recovery)
+
+    def offer_recovery(self):
+        """Offer to carry on with the timers that a crashed or killed session left behind"""
+        recovered = self.timer_manager.checkpoint.load()
+        if not recovered:
+            return
+        timers = "\n".join(f"{stopwatch.description} ({stopwatch.project}), started at {stopwatch.start_time_str()}, "
+                           f"{self.format_time(stopwatch.elapsed())} timed up to {time.strftime('%H:%M:%S', time.localtime(state['saved_at']))}"
+                           f"{'' if state.get('running', True) else ', paused'}"
+                           for stopwatch, state in recovered)
+        message = f"Timers were left running by an earlier session:\n\n{timers}\n\nResume them?"
+        if messagebox.askyesno("Recover timers", message, parent=self.master):
+            for stopwatch, state in recovered:
+                self.add_timer(stopwatch, state)
+        else:
+            self.timer_manager.checkpoint.clear()
+
+    def poll_updates(self):
+        """Show a notice once the background update check pulled a new version"""
+        if not self.update_checker.done.is_set():
+            self.master.after(1000, self.poll_updates)
+        elif self.update_checker.updated:
+            self.update_label.config(text="A new version has been downloaded, please restart the timer.")
+            self.update_label.pack(side="bottom")
+
+    def poll_sync(self):
+        """Pick up finished background sync tasks and keep the status label current"""
+        if self.sync_poll_id:
+            self.master.after_cancel(self.sync_poll_id)
+            self.sync_poll_id = None
+        # Read busy before polling: tasks report that they finished before they stop being busy
+        busy = self.sync_worker.busy
+        for name, ok in self.sync_worker.poll():
+            if name == "download" and ok:
+                self.refresh_choices()
+            elif name == "save" and not len(self.timer_manager):
+                logging.info('done uploading new time entries, shutting down timer')
+                self.master.destroy()
+                return
+        status = self.sync_worker.status
+        self.status_label.config(text="" if status == "idle" else status)
+        if busy:
+            self.sync_poll_id = self.master.after(200, self.poll_sync)
+
+    def refresh_choices(self):
+        """Update the description and project choices once a fresh timesheet is available"""
+        self.unique_projects, last_description, last_project = self.get_unique_data()
+        self.description_combobox.config(values=self.search_choices("descriptions", self.description_combobox.get()))
+        self.project_combobox.config(values=self.search_choices("projects", self.project_combobox.get()))
+        if last_description and self.description_combobox.get() == "Select or type a description":
+            self.description_combobox.set(last_description)
+        if last_project and self.project_combobox.get() == "Select or type a project":
+            self.project_combobox.set(last_project)
 
-    def get_descriptions_with_durations(self):
-        data = []
-        monthly_data = defaultdict(lambda: {'entries': [], 'total_duration': timedelta(), 'project_durations': defaultdict(timedelta)})
-
-        try:
-            with open(properties['timesheet_path'], 'r') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row:
-                        start_date_time, elapsed_time, description, project = row
-                        start_dt = datetime.strptime(start_date_time, '%Y-%m-%d %H:%M:%S')
-                        elapsed_h, elapsed_m, elapsed_s = map(int, elapsed_time.split(':'))
-                        elapsed_td = timedelta(hours=elapsed_h, minutes=elapsed_m, seconds=elapsed_s)
-
-                        month_key = start_dt.strftime('%Y-%m')
-                        monthly_data[month_key]['entries'].append({
-                            'Date': start_dt.strftime('%Y-%m-%d'), 
-                            'Description': description, 
-                            'Duration': elapsed_td,
-                            'Project': project
-                        })
-                        monthly_data[month_key]['total_duration'] += elapsed_td
-                        monthly_data[month_key]['project_durations'][project] += elapsed_td
-
-            for month_key, month_data in monthly_data.items():
-                month_name = datetime.strptime(month_key, '%Y-%m').strftime('%B %Y')
-                data.append({'Date': f'Month: {month_name}', 'Description': '', 'Duration': '', 'Project': 'All'})
-                data.extend(month_data['entries'])
-                for project, duration in month_data['project_durations'].items():
+    def get_descriptions_with_durations(self, project_filter=None):
+        """The Summary window's rows, generated as the table asks for them: the entries
+        themselves, shared with the store rather than copied, with month headings and totals"""
+        months = get_store(properties['timesheet_path'], properties['storage']).months(project_filter)
+        # the months as they are now, saving an entry adds to them while the window is open
+        months = [(month_key, month_data['entries'], len(month_data['entries']), dict(month_data['projects']))
+                  for month_key, month_data in months.items()]
+
+        def rows():
+            for month_key, entries, count, projects in months:
+                if not project_filter:
+                    month_name = datetime.strptime(month_key, '%Y-%m').strftime('%B %Y')
+                    yield "month", (f'Month: {month_name}', "", "")
+                yield from itertools.islice(entries, count)
+                for project, seconds in projects.items():
                     # Append monthly total for each project
-                    data.append({
-                        'Date': 'Monthly Total', 
-                        'Description': '', 
-                        'Duration': format_timedelta(duration),
-                        'Project': project
-                    })
+                    yield "total", ('Monthly Total', project, format_timedelta(timedelta(seconds=seconds)))
 
-        except FileNotFoundError:
-            pass
+        return rows()
 
+    def get_rollup(self, group_by, project_filter=None):
+        from reporting import load_columns, rollup  # only needed for the Summary window, numpy is slow to import
+        data = []
+        columns = load_columns(properties['timesheet_path'])
+        top = 10 if group_by == "top tasks" else None
+        for label, seconds, entries in rollup(columns, "description" if top else group_by, project=project_filter or None, top=top):
+            data.append((None, (label if not top else f"{len(data) + 1}.",
+                                label if top else f"{entries} entries",
+                                format_timedelta(timedelta(seconds=seconds)))))
         return data
 
-    def update_summary_view(self, scrollable_frame, project_filter):
-        bg_color1 = "#703224"  # A light gray color
+    def update_summary_view(self, summary_table, project_filter, group_by="entries"):
+        # Filtered data based on project, either every entry or totals grouped by group_by
+        if group_by == "entries":
+            descriptions_with_durations = self.get_descriptions_with_durations(project_filter)
+        else:
+            descriptions_with_durations = self.get_rollup(group_by, project_filter)
 
-        # Clear previous content
-        for widget in scrollable_frame.winfo_children():
-            widget.destroy()
+        logging.info(f"showing {project_filter} by {group_by}")
+
+        # Display filtered data, replacing the rows of the existing table in place
+        summary_table.set_rows(descriptions_with_durations)
 
-        # Filtered data based on project
-        descriptions_with_durations = self.get_descriptions_with_durations()
-        
-        if project_filter:
-            descriptions_with_durations = [item for item in descriptions_with_durations if item.get('Project') == project_filter or (item.get('Date') == 'Monthly Total' and item.get('Project') == project_filter)]
-
-        logging.info(f"showing {project_filter}")
-
-         # Display filtered data
-        for index, row_data in enumerate(descriptions_with_durations):
-            if "Month:" in row_data['Date']:
-                Label(scrollable_frame, text=row_data['Date'], width=70, bg=bg_color1, anchor='w').grid(row=index, column=0, columnspan=4)
-            elif "Monthly Total" in row_data['Date']:
-                #Label(scrollable_frame, text=row_data['Date'], width=10, anchor='w').grid(row=index, column=0)
-                #Label(scrollable_frame, text=row_data['Description'], width=50, anchor='w').grid(row=index, column=1)
-                Label(scrollable_frame, text=row_data['Duration'], width=70,bg=bg_color1, anchor='center').grid(row=index, column=0, columnspan=4)  # Center align the duration
-            else:
-                Label(scrollable_frame, text=row_data['Date'], width=10).grid(row=index, column=0)
-                Label(scrollable_frame, text=row_data['Description'], width=50).grid(row=index, column=1)
-                Label(scrollable_frame, text=row_data['Duration'], width=10).grid(row=index, column=2)
-     
         return descriptions_with_durations
 
     def show_details_window(self):
-        bg_color1 = "#703224"  # A light gray color
-
+        from reporting import GROUPINGS
         new_window = Toplevel(self.master)
         new_window.title("Details Window")
 
@@ -196,145 +274,134 @@ class TimesheetApp:
         project_filter_combobox = Combobox(new_window, textvariable=project_filter_var, values=self.unique_projects)
         project_filter_combobox.pack()
 
+        # Show every entry or totals per day, week, month, project, description or the top tasks
+        group_by_var = StringVar(value="entries")
+        group_by_combobox = Combobox(new_window, textvariable=group_by_var, values=("entries",) + GROUPINGS + ("top tasks",), state="readonly")
+        group_by_combobox.pack()
+
         # Button to apply filter
-        filter_button = Button(new_window, text="Filter", command=lambda: self.update_summary_view(scrollable_frame, project_filter_var.get()))
+        filter_button = Button(new_window, text="Filter", command=lambda: self.update_summary_view(summary_table, project_filter_var.get(), group_by_var.get()))
         filter_button.pack()
  
         # Set initial size
         new_window.geometry("800x600")  # Adjust width (800) and height (600) as per your requirement
-    
 
-        canvas = Canvas(new_window)
-        scrollbar = Scrollbar(new_window, orient="vertical", command=canvas.yview)
-        scrollable_frame = Frame(canvas)
+        summary_table = SummaryTable(new_window)
+        self.update_summary_view(summary_table, None)
 
-        canvas.configure(yscrollcommand=scrollbar.set)
-
-        # Bind the mouse wheel event to the canvas scroll
-        #canvas.bind("<MouseWheel>", lambda event: canvas.yview_scroll(-1*(event.delta//120), "units"))
-        new_window.bind("<MouseWheel>", lambda event: canvas.yview_scroll(-1*(event.delta//120), "units"))
-
-        
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(
-                scrollregion=canvas.bbox("all")
-            )
-        )
-
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-        
-
-        descriptions_with_durations = self.update_summary_view(scrollable_frame, None)
+    def get_unique_data(self):
+        store = get_store(properties['timesheet_path'], properties['storage'])
+        last_entry = store.last_entry()
+        last_description = last_entry.description if last_entry else None
+        last_project = last_entry.project if last_entry else None
 
-        for index, row_data in enumerate(descriptions_with_durations):
-            if "Month:" in row_data['Date']:
-                Label(scrollable_frame, text=row_data['Date'], width=70, bg=bg_color1, anchor='w').grid(row=index, column=0, columnspan=4)
-            elif "Monthly Total" in row_data['Date']:
-                #Label(scrollable_frame, text=row_data['Date'], width=10, anchor='w').grid(row=index, column=0)
-                #Label(scrollable_frame, text=row_data['Description'], width=50, anchor='w').grid(row=index, column=1)
-                Label(scrollable_frame, text=row_data['Duration'], width=70,bg=bg_color1, anchor='center').grid(row=index, column=0, columnspan=4)  # Center align the duration
-            else:
-                Label(scrollable_frame, text=row_data['Date'], width=10).grid(row=index, column=0)
-                Label(scrollable_frame, text=row_data['Description'], width=50).grid(row=index, column=1)
-                Label(scrollable_frame, text=row_data['Duration'], width=10).grid(row=index, column=2)
+        return store.projects(), last_description, last_project
 
-        canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
+    def search_choices(self, which, text):
+        """The descriptions or projects best matching text, the most used ones for no text"""
+        if text.startswith("Select or type a "):
+            text = ""
+        return getattr(get_search(properties['timesheet_path']), which).search(text, CHOICES)
 
-    def get_unique_data(self):
-        descriptions = set()
-        projects = set()
-        last_description = None
-        last_project = None
-
-        try:
-            with open(properties['timesheet_path'], 'r') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row:
-                       # print(row)
-                        descriptions.add(row[2])  # Assuming description is in the first column
-                        projects.add(row[3])  # Assuming project is in the second column
-                        last_description = row[2]
-                        last_project = row[3]
-        except FileNotFoundError:
-            pass  # File not found, return empty sets and None values
-
-        return list(descriptions), list(projects), last_description, last_project
+    def filter_choices(self, event, combobox, which):
+        # Offer the matches for what has been typed so far, keys that move through the list keep it
+        if event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+            return
+        combobox.config(values=self.search_choices(which, combobox.get()))
 
         
     def start_timer(self):
-        # Get the selected description and project
-        self.description = self.description_combobox.get()
-        self.project = self.project_combobox.get()
-
-        # Hide the input fields and display the timer and titles
-        self.description_combobox.pack_forget()
-        self.project_combobox.pack_forget()
-        self.start_button.pack_forget()
-        
-        self.project_label.config(text=f"{self.project}")
-        self.project_label.pack()
-
-        self.description_label.config(text=f"{self.description}")
-        self.description_label.pack()
-
-        if not self.already_started:
-            self.start_time = time.time()
-            self.already_started = True
-
-        self.timer_label.pack()
-        # Display the stop button when the timer starts
-        self.stop_button.pack()
+        # Start a timer for the selected description and project, next to the ones already running
+        self.add_timer(Stopwatch(self.description_combobox.get(), self.project_combobox.get()))
+
+    def add_timer(self, stopwatch, state=None):
+        """Add and start a timer; one recovered from a checkpoint (state) stays paused if it was"""
+        if state is None:
+            name = self.timer_manager.add(stopwatch)
+            self.timer_manager.start(name)
+        else:
+            name = self.timer_manager.restore(stopwatch, state)
+        self.timer_list.insert("", "end", iid=name, values=(name, stopwatch.project, "", ""))
+        self.timer_list.selection_set(name)
+        # Display the timers once the first one starts
+        self.timer_frame.pack(before=self.details_button)
+        self.schedule_checkpoint()
         self.update_clock()
-    
-    def stop_timer(self):
-        self.pause_start_time = time.time()
-        self.paused = True
-        self.start_time_str  = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.start_time))
-        self.elapsed_time = time.time() - self.start_time
-
-        # Hide the timer label and stop button, and show the input fields again
-        self.resume_button.pack()
-        self.save_button.pack()
-        self.stop_button.pack_forget()
-        
-        
-        # Reset the start time to stop the timer
-        #self.start_time = None
 
-    def resume_timer(self):
-        self.paused = False
-        pause_duration = time.time() - self.pause_start_time
-        self.start_time += pause_duration
-        self.resume_button.pack_forget()  # Hide the resume button
-        self.save_button.pack_forget()  # Hide the save button when resuming
-        self.start_button.invoke()  # Invoke the start button's action to start the timer again
+    def selected_timers(self):
+        """The names of the selected timers, or every timer when none is selected"""
+        return list(self.timer_list.selection()) or list(self.timer_manager.timers)
 
+    def toggle_timers(self):
+        for name in self.selected_timers():
+            self.timer_manager.toggle(name)
+        self.schedule_checkpoint()
+        self.update_clock()
 
-        
-    def save_entry(self):
-        self.save_button.pack_forget()
-        # Download again in case another system has updated this file since we last checked
-        download_timesheet(properties)
-        save_time(self.description,self.project, self.elapsed_time,self.start_time_str)
-        # Upload timesheet.csv to the remote system
-        upload_timesheet(properties)
-        logging.info('done uploading new time entry, shutting down timer')
-        self.master.destroy()
+    def save_entries(self):
+        # The entries are journaled right away with a single write, then the timesheet is downloaded
+        # again in case another system updated it, and the entries are added and uploaded together in
+        # the background; the window closes once that is done and no timers are left
+        names = self.selected_timers()
+        entries = self.timer_manager.stop(names)
+        save_time(self.sync_worker, entries)
+        self.timer_manager.save_checkpoint()
+        self.timer_list.delete(*names)
+        if not len(self.timer_manager):
+            self.timer_frame.pack_forget()
+        self.schedule_checkpoint()
+        self.update_clock()
+        self.poll_sync()
 
     def update_clock(self):
-        if self.start_time and not self.paused:
-            elapsed_time = time.time() - self.start_time 
-            mins, sec = divmod(elapsed_time, 60)
-            hours, mins = divmod(mins, 60)
-            self.timer_label.config(text="Elapsed time:\n{:02d}:{:02d}:{:02d}".format(int(hours), int(mins), int(sec)))
-            
-            # Update the timer label every second
-            self.master.after(1000, self.update_clock)
-        
+        """Show the elapsed time of every timer and schedule the next update for the moment
+        the next running timer reaches a whole second. There is only ever one pending update;
+        nothing is scheduled while every timer is paused or the window is iconified."""
+        self.cancel_clock()
+        for name, stopwatch in self.timer_manager.timers.items():
+            self.timer_list.set(name, "elapsed", self.format_time(stopwatch.elapsed()))
+            self.timer_list.set(name, "state", "" if stopwatch.running else "paused")
+
+        # The big clock and titles show the selected timer, or the most recent one
+        names = list(self.timer_list.selection()) or list(self.timer_manager.timers)[-1:]
+        if names:
+            stopwatch = self.timer_manager.timers[names[0]]
+            self.project_label.config(text=f"{stopwatch.project}")
+            self.description_label.config(text=f"{stopwatch.description}")
+            self.timer_label.config(text="Elapsed time:\n{}".format(self.format_time(stopwatch.elapsed())))
+
+        tick = self.timer_manager.next_tick()
+        if tick is not None and self.master.state() != "iconic":
+            # Update on the next second boundary, 1 ms late so the labels have moved on
+            self.clock_after_id = self.master.after(int(tick * 1000) + 1, self.update_clock)
+
+    def cancel_clock(self):
+        if self.clock_after_id:
+            self.master.after_cancel(self.clock_after_id)
+            self.clock_after_id = None
+
+    def schedule_checkpoint(self):
+        """Checkpoint the timers every CHECKPOINT_INTERVAL seconds while any of them runs,
+        including while the window is iconified"""
+        if self.checkpoint_after_id:
+            self.master.after_cancel(self.checkpoint_after_id)
+            self.checkpoint_after_id = None
+        if self.timer_manager.running:
+            self.checkpoint_after_id = self.master.after(CHECKPOINT_INTERVAL * 1000, self.save_checkpoint)
+
+    def save_checkpoint(self):
+        self.checkpoint_after_id = None
+        self.timer_manager.save_checkpoint()
+        self.schedule_checkpoint()
+
+    def on_window_state(self, event):
+        # Stop updating the clock while iconified and catch up as soon as the window is shown again
+        if event.widget is not self.master:
+            return
+        if event.type == EventType.Unmap:
+            self.cancel_clock()
+        else:
+            self.update_clock()
 
     def format_time(self, duration):
         """Format duration as hours, minutes, and seconds"""
@@ -342,38 +409,48 @@ class TimesheetApp:
         minutes, seconds = divmod(remainder, 60)
         return "{:02d}:{:02d}:{:02d}".format(int(hours), int(minutes), int(seconds))
 
-# Run the Tkinter app
-if __name__ == "__main__":
-
+def start_background_work(app, sync_worker, update_checker):
+    """Started once the window has been drawn, so the first frame never waits for ssh, scp or git"""
+    # Download timesheet.csv from the remote system, the window shows the local copy
+    # and picks up the remote one when it arrives
+    sync_worker.download()
+    # Upload entries that an earlier session could not
+    sync_worker.flush()
+    # Check for a new version, at most once per update interval
+    update_checker.start()
+    app.poll_sync()
+
+def main(argv=None):
+    """Set up the timer window and return its root, ready for mainloop"""
+    global properties
     parser = argparse.ArgumentParser(description='Track Time')
     parser.add_argument('-log', dest='loglevel', type=str, default='info', required=False, help='log level')
     parser.add_argument('-work', dest='workdir', type=str, default='.')
-    parser.add_argument('-host', dest='host', type=str, default='timer')
-    parser.add_argument('-hostpath', dest='hostpath', type=str, default='~/timer')
-    parser.add_argument('-remote', dest='remote', type=str, default='true')
+    parser.add_argument('-profile', dest='profile', type=str, default=None, help='write a cProfile of the session to this file')
+    # -host, -storage, -sync and the other property flags override the work directory's timer.properties
+    add_property_flags(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     args.workdir = os.path.expanduser(args.workdir)  # Add this line to expand '~' to the user's home directory
 
-    properties = {
-        "host": args.host,
-        "path": args.hostpath,
-        "workdir": args.workdir,
-        "remote_save": args.remote,
-        "timesheet_path" : f"{args.workdir}{os.sep}timesheet.csv"
-    }
+    properties = load_properties(args.workdir, args)
     log_path = f"{properties['workdir']}{os.sep}timer.log"
     
     logging.basicConfig(filemode="w",force=True,filename=f"{log_path}", level=args.loglevel.upper(), format="%(asctime)s - %(levelname)s - %(message)s")
     
     logging.info("started timer app")
-    #sys.exit()
+    configure_metrics(properties, args.workdir)
+    if args.profile:
+        start_profile(args.profile)
 
     root = Tk()
-    # Read properties from the timer.properties file
-    
-    # Download timesheet.csv from the remote system
-    download_timesheet(properties)
-    app = TimesheetApp(root)
-    root.mainloop()
+    sync_worker = SyncWorker(properties, properties['timesheet_path'])
+    update_checker = UpdateChecker(properties)
+    # The window opens with the local timesheet, syncing and the update check start once it is drawn
+    app = TimesheetApp(root, sync_worker, update_checker)
+    root.after_idle(start_background_work, app, sync_worker, update_checker)
+    return root
 
+# Run the Tkinter app
+if __name__ == "__main__":
+    main().mainloop()
@@ -0,0 +1,81 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from metrics import phase, profiled
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(SCRIPT_DIR, ".timer_update_state.json")
+DEFAULT_INTERVAL_HOURS = 24
+GIT_TIMEOUT = 60  # seconds
+
+
+def check_git_pull():
+    """Performs a git pull and checks if any changes were made."""
+    import subprocess  # imported on the background thread, it is slow to import at startup
+    env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+    with phase("update_check") as fields:
+        result = subprocess.run(["git", "pull"], cwd=SCRIPT_DIR, capture_output=True, text=True,
+                                timeout=GIT_TIMEOUT, env=env)
+        logging.info(f"git check results: {result}")
+        result.check_returncode()
+        fields["updated"] = "Already up to date." not in result.stdout
+    return fields["updated"]
+
+
+class UpdateChecker:
+    """Checks for a new version of the scripts with git pull on a background thread.
+
+    The check runs at most once per update_check_interval hours; the time and outcome
+    of the last check are kept in a small state file so later launches can skip it.
+    The front-ends look at updated once done is set and tell the user to restart.
+    """
+
+    def __init__(self, properties, state_file=STATE_FILE):
+        self.interval = float(properties.get('update_check_interval', DEFAULT_INTERVAL_HOURS)) * 3600
+        self.state_file = state_file
+        self.done = threading.Event()
+        self.updated = False
+
+    def _load_state(self):
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_file)
+
+    def due(self):
+        if self.interval < 0:
+            return False
+        return time.time() - self._load_state().get('last_check', 0) >= self.interval
+
+    def start(self):
+        """Start the check in the background if it is due"""
+        if not self.due():
+            logging.info("skipping update check, the last one was recent")
+            self.done.set()
+            return
+        threading.Thread(target=profiled(self._run), name="update-check", daemon=True).start()
+
+    def _run(self):
+        import subprocess
+        state = {'last_check': time.time()}
+        try:
+            self.updated = check_git_pull()
+            state['result'] = "updated" if self.updated else "up to date"
+        except (subprocess.SubprocessError, OSError) as e:
+            logging.warning(f"update check failed: {e}")
+            state['result'] = f"failed: {e}"
+        try:
+            self._save_state(state)
+        except OSError as e:
+            logging.warning(f"could not record update check: {e}")
+        self.done.set()